@@ -2,21 +2,66 @@
 #           can record videos without sound and take stapshots
 # Copyright(C)  Val Krigan, MIT, see LICENSE file
 
-import sys, os, time
+import sys, os, time, signal, math
+start_stamp = time.perf_counter()  # for time to the first frame, see FrameProfiler
+import threading, queue, itertools, csv, json, struct, importlib, mmap, bisect, hashlib, weakref
+from collections import OrderedDict
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 from datetime import datetime
-import cv2
-import tkinter as tk
-from tkinter import simpledialog
-from PIL import Image, ImageTk
+
+# stands for a module until it's used for the first time, then imports it and
+# puts the real one into globals, so --help doesn't wait for numpy and cv2,
+# and headless runs never load tkinter and PIL
+class LazyModule:
+    def __init__(self, alias, name=None):
+        self._alias = alias
+        self._name = name or alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return  getattr(module, attr)
+
+cv2 = LazyModule('cv2')
+np = LazyModule('np', 'numpy')
+tk = LazyModule('tk', 'tkinter')
+simpledialog = LazyModule('simpledialog', 'tkinter.simpledialog')
+Image = LazyModule('Image', 'PIL.Image')
+ImageTk = LazyModule('ImageTk', 'PIL.ImageTk')
 
 # global constants and varibles
 record_folder = "./camplay"  # Predefined folder for recording
 initial_fps = None  # recording fps, if None then as is from the camera
 codec_str = 'mp4v' # H264 mp4v
-video_fourcc = cv2.VideoWriter_fourcc(*codec_str)  # Use 'mp4v' for MP4 format
+video_fourcc = None  # cv2.VideoWriter_fourcc(*codec_str), CamPlay makes its own
 video_ext = "mp4"   # video recording extensions, defines file format
 image_ext = "jpg"   # snapshots' extensions, defines encoding format, can be png, tiff..
 verbose = False     # add some info output to stdout
+discovery_timeout = 3.0  # seconds to wait for any of cam=<i>,<j>.. to open
+record_queue = 32   # how many frames may wait for the encoder
+record_policy = 'drop-oldest'  # what to do when encoder falls behind, see RecorderCV2
+snapshot_workers = 2  # threads encoding and writing snapshots
+burst_count = 10      # frames in a burst, see BurstCapture
+burst_time = None     # or burst duration in seconds, overrides burst_count
+best_window = 1.0     # seconds of frames the sharpest snapshot is picked from, see BestSnapshot
+preroll_seconds = 0   # keep that many seconds before recording starts, 0 - off
+preroll_mb = 64       # memory budget of the pre-roll, see PreRollBuffer
+motion_level = None   # share of changed pixels that starts recording, see MotionDetector
+motion_post_roll = 5.0  # seconds of calm before recording stops
+proc_workers = 0      # processes running frame_proc, 0 - inline, see ProcPool
+proc_depth = None     # frames in flight, None - twice the workers
+proc_order = 'ordered'  # or 'latest'
+presenter_name = 'tk'  # how frames are shown, see presenters
+http_address = None   # (host, port) to stream on, see StreamServer
+stream_quality = 80   # default jpeg quality of the stream, clients can ask for another with ?q=
+frame_pool = True     # reuse frame buffers instead of allocating per frame, see FramePool
+burn_red_cross = False  # red cross goes into recordings and snapshots too, see OverlayLayer
+display_fps = 60      # max window refresh rate, capture goes at its own, see FramePacer
+profile_csv = None     # file for per-frame timings, see FrameProfiler
 
 default_camera_index = 0
 #default_resolutions = ["640x480", "800x600", "1024x768", "1280x720", "1920x1080"]
@@ -25,11 +70,34 @@ zoom_scale = 1.2
 
 sticky_scroll = True  # if scroll point sticks to finger/mouse
 
-# Function to draw a red cross on the frame
+# what cameras can do is probed once and kept here, see CameraCV2.GetCapabilities
+playback_cache_mb = 256  # decoded frames kept for stepping back and forth, see CameraPlayback
+caps_cache_path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                               'camplay', 'capabilities.json')
+capture_format = None  # fourcc asked from the camera, like MJPG, None - camera's default
+capture_raw = False   # keep MJPG compressed, decode only when needed, see FrameGrabber
+decode_workers = 2    # threads decoding compressed frames
+rec_passthrough = False  # record camera's MJPG as is into avi, no decode and re-encode
+initial_roi = None    # (x0, y0, width, height) set at start, see CameraCV2.SetROI
+record_full = False   # with ROI still record the full frame, unprocessed
+segment_minutes = None  # start a new file every that many minutes of video, see RecorderCV2
+segment_mb = None     # or when the file grows over that many megabytes
+record_budget_mb = None  # delete oldest recordings when record_folder is bigger
+timelapse_interval = None  # seconds between time-lapse shots, see TimeLapse
+timelapse_close = False  # close the camera between shots
+timelapse_video = False  # into one video instead of image files
+timelapse_batch = 10  # shots kept in memory before they are written
+timelapse_fps = 25    # playback rate of time-lapse video
+raw_ring_frames = None  # record lossless into a ring file of that many frames, see RawRingWriter
+probe_caps = True     # probe what isn't cached yet
+reprobe_caps = False  # ignore the cache and probe again
+
+# Function to draw a red cross on the frame, at its center or at pos (pixels).
+# opaque on BGRA overlay canvases too, see OverlayLayer
 def draw_red_cross(frame, pos=None):
-    center = (frame.shape[1] // 2, frame.shape[0] // 2)
-    cv2.line(frame, (center[0] - 10, center[1]), (center[0] + 10, center[1]), (0, 0, 255), 2)
-    cv2.line(frame, (center[0], center[1] - 10), (center[0], center[1] + 10), (0, 0, 255), 2)
+    center = pos if isinstance(pos, tuple) else (frame.shape[1] // 2, frame.shape[0] // 2)
+    cv2.line(frame, (center[0] - 10, center[1]), (center[0] + 10, center[1]), (0, 0, 255, 255), 2)
+    cv2.line(frame, (center[0], center[1] - 10), (center[0], center[1] + 10), (0, 0, 255, 255), 2)
     return frame
 
 def draw_green_cross(frame, pos=None):
@@ -43,15 +111,42 @@ def draw_green_cross(frame, pos=None):
     cv2.line(frame, (pos[0], pos[1] - size), (pos[0], pos[1] + size), (0, 255, 0), 2)
     return frame
 
+# sharpness: variance of the Laplacian over a grayscale square around pos (as
+# in draw_green_cross: relative floats, pixels or None for the center), a third
+# of the frame big, strided down to about size pixels. a few hundred
+# microseconds at 1080p, so it can run on every frame. bigger is sharper,
+# values compare only between frames of the same scene
+def focus_score(frame, pos=None, size=256):
+    height, width = frame.shape[:2]
+    if pos is None or not isinstance(pos, tuple):
+        pos = (width // 2, height // 2)
+    elif not isinstance(pos[0], int):
+        pos = (int(width * pos[0]), int(height * pos[1]))
+    side = max(min(width, height) // 3, 8)
+    x0 = min(max(pos[0] - side // 2, 0), max(width - side, 0))
+    y0 = min(max(pos[1] - side // 2, 0), max(height - side, 0))
+    step = max(side // size, 1)
+    # green channel stands for gray, no cvtColor pass over the frame
+    gray = frame[y0:y0 + side:step, x0:x0 + side:step, 1] if frame.ndim == 3 else frame[y0:y0 + side:step, x0:x0 + side:step]
+    laplacian = cv2.Laplacian(np.ascontiguousarray(gray), cv2.CV_16S)
+    _, std = cv2.meanStdDev(laplacian)
+    return  float(std[0, 0]) ** 2
+
+# frame_proc for live focus assistance: the score, bigger when focused, at pos
+def draw_focus(frame, pos=None):
+    score = focus_score(frame, pos)
+    frame = draw_green_cross(frame, pos)
+    cv2.putText(frame, f"focus {score:.0f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
+    return  frame
+
 # wraps cv2 camera in common interface
 class  CameraCV2:
     # note: it's a class method, no self
     def check_camera(camera_index):
         # Attempt to open the first camera, 
-        log_level = cv2.getLogLevel()
-        cv2.setLogLevel(0)  # suppressing logs
+        log_level = set_cv2_log_level(0)  # suppressing logs
         cap = cv2.VideoCapture(camera_index)
-        cv2.setLogLevel(log_level)
+        set_cv2_log_level(log_level)
 
         # Check if the camera is opened successfully
         if cap.isOpened():
@@ -60,11 +155,16 @@ class  CameraCV2:
         else:
             return False
     
-    def __init__(self, cam_idx, start=False):
+    def __init__(self, cam_idx, start=False, fourcc=None, raw=False):
         self.idx = cam_idx
         self.id = None
         self.cap = None   # capture device, i.e. camera
         self.maxResolution = None
+        self.caps = None  # see GetCapabilities
+        self.fourcc = fourcc  # pixel format to ask for, like 'MJPG'
+        self.raw = raw        # MJPG stays compressed, see ReadCompressed
+        self.roi = None       # (x0, y0, width, height), None is the full frame
+        self.hw_roi = None    # full (width, height) while the camera itself crops
         if start:
             self.Open()
     
@@ -75,18 +175,24 @@ class  CameraCV2:
         else:
             idx = self.idx
         # if it's one of choise
+        cap = None
         if '__len__' in dir(idx):  # which both list and tuple have
-            for i in idx:
-                id = int(i)
-                if type(self).check_camera(id):
-                    break
+            # all are tried at once, the first one which opens is kept open
+            id, cap = discover_camera([int(i) for i in idx], discovery_timeout)
+            if cap is None:
+                id = int(idx[0])
         else:
             id = idx
         #print("openning: ", id)
         
         # at this point idx is a single value, hope camera didn't get disconneted
-        self.cap = cv2.VideoCapture(id)
+        self.cap = cap or cv2.VideoCapture(id)
         self.id = id
+        if self.fourcc and self.cap.isOpened():
+            # most usb cameras give full HD at 30 fps only in MJPG, YUYV is ~5 fps
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+            if self.raw and self.fourcc == 'MJPG':
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)  # v4l2 backend then gives jpeg bytes
 
     def IsOpen(self):
         return  self.cap and self.cap.isOpened()
@@ -102,69 +208,2085 @@ class  CameraCV2:
 
     # returns (width, height)
     def GetResolution(self):
+        if self.hw_roi:
+            return  self.hw_roi  # camera reports ROI size
         return  self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
     
     def SetResolution(self, width, height):
         return  self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width) \
             and self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)    
 
-    # returns  (success, frame), success==False if reading frame fails
-    def Read(self):
-        return  self.cap.read()
+    # returns  (success, frame), success==False if reading frame fails.
+    # buf: array to read into, if it fits the frame, see FramePool
+    def Read(self, buf=None):
+        ret, frame = self.cap.read(image=buf) if buf is not None else self.cap.read()
+        if ret and frame.ndim < 3:
+            frame = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_COLOR)  # compressed, see ReadCompressed
+            ret = frame is not None
+        return  ret, frame
+
+    # if frames come compressed, see ReadCompressed
+    def IsCompressed(self):
+        return  bool(self.raw and self.fourcc == 'MJPG' and self.IsOpen())
+
+    # returns (success, packet): jpeg bytes as 1-d uint8 array, or a decoded
+    # BGR frame if the backend ignored CAP_PROP_CONVERT_RGB
+    def ReadCompressed(self):
+        ret, packet = self.cap.read()
+        if ret and packet.ndim < 3:
+            packet = packet.reshape(-1)
+        return  ret, packet
 
     # makes sense only for video, photo cameras don't support it
     def GetFPS(self):
-        self.cap.get(cv2.CAP_PROP_FPS)
+        return  self.cap.get(cv2.CAP_PROP_FPS)
+
+    # stable key for caches, survives re-plugging into another port where the
+    # OS tells device name and path (linux), otherwise backend and index
+    def GetIdentity(self):
+        name, path = None, None
+        if sys.platform.startswith('linux') and isinstance(self.id, int):
+            try:
+                with open(f"/sys/class/video4linux/video{self.id}/name") as f:
+                    name = f.read().strip()
+            except OSError:
+                pass
+            by_id = "/dev/v4l/by-id"
+            if os.path.isdir(by_id):
+                for entry in sorted(os.listdir(by_id)):
+                    if os.path.realpath(os.path.join(by_id, entry)) == f"/dev/video{self.id}":
+                        path = entry
+                        break
+        backend = self.cap.getBackendName() if self.cap else "?"
+        return  f"{backend}:{name or 'camera'}:{path or self.id}"
+
+    # returns cached capabilities, probes resolutions (["WxH"]) which aren't known yet:
+    #   {'resolutions': {"WxH": {fourcc: fps}}, 'unsupported': ["WxH"], 'probed': date}
+    def GetCapabilities(self, resolutions=None, probe=True, reprobe=False):
+        resolutions = resolutions or default_resolutions
+        identity = self.GetIdentity()
+        cache = load_caps_cache()
+        caps = cache.get(identity)
+        if reprobe or not caps:
+            caps = {'resolutions': {}, 'unsupported': []}
+        missing = [r for r in resolutions if r not in caps['resolutions'] and r not in caps['unsupported']]
+        if missing and probe and self.IsOpen():
+            if verbose: print(f"probing {identity}: {missing}")
+            found = probe_camera(self.cap, missing)
+            caps['resolutions'].update(found)
+            caps['unsupported'] += [r for r in missing if r not in found]
+            caps['probed'] = datetime.now().isoformat(timespec='seconds')
+            cache[identity] = caps
+            save_caps_cache(cache)
+        if not caps['resolutions'] and not caps['unsupported']:
+            return  None
+        self.caps = caps
+        sizes = self.GetSupportedResolutions()
+        self.maxResolution = max(sizes, key=lambda s: s[0] * s[1]) if sizes else None
+        return  caps
 
     # returns [(width, height)] if supported by camera, othewise None
+    # note: known after GetCapabilities()
     def GetSupportedResolutions(self):
-        return  None
+        if not self.caps:
+            return  None
+        return  sorted(tuple(map(int, r.split('x'))) for r in self.caps['resolutions'])
 
     def GetMaxResolution(self):
         return  self.maxResolution
     
-    # think: set ROI emulation with frame cropping
     # returns (x0,y0, width,height) of range of interest in original image
     # note: in current resolution. i.e. with resolution change ROI should
-    #       be updated.
-    def GetROI(self):  # for cv2 always full screen
+    #       be updated, see CamPlay.change_frame_size
+    def GetROI(self):
+        if self.roi:
+            return  self.roi
         width, height = self.GetResolution()
-        return  (0,0, width, height)
+        return  (0,0, int(width), int(height))
     
+    # cameras which can crop themselves (XIMEA backend) do it, others get
+    # emulated with a numpy view in Crop(). full frame resets ROI.
+    # returns False if ROI is empty
     def SetROI(self, x0, y0, width, height):
-        return  False   # not supported for cv2
+        full_width, full_height = map(int, self.GetResolution())
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        width, height = min(int(width), full_width - x0), min(int(height), full_height - y0)
+        if width <= 0 or height <= 0:
+            return  False
+        self.ResetROI()
+        if (x0, y0, width, height) == (0, 0, full_width, full_height):
+            return  True
+        if self._set_hw_roi(x0, y0, width, height):
+            self.hw_roi = (full_width, full_height)
+        self.roi = (x0, y0, width, height)
+        return  True
+
+    def ResetROI(self):
+        if self.hw_roi:
+            self._set_hw_roi(0, 0, *self.hw_roi)
+        self.roi, self.hw_roi = None, None
+
+    def _set_hw_roi(self, x0, y0, width, height):
+        if not self.cap or not self.IsOpen() or self.cap.getBackendName() != 'XIMEA':
+            return  False
+        # offsets go to 0 first, so any size is accepted, then they are moved
+        props = ((cv2.CAP_PROP_XI_OFFSET_X, 0), (cv2.CAP_PROP_XI_OFFSET_Y, 0),
+                 (cv2.CAP_PROP_XI_WIDTH, width), (cv2.CAP_PROP_XI_HEIGHT, height),
+                 (cv2.CAP_PROP_XI_OFFSET_X, x0), (cv2.CAP_PROP_XI_OFFSET_Y, y0))
+        return  all(self.cap.set(prop, value) for prop, value in props)
+
+    # ROI part of the frame, a view into it, no copy. frames from the
+    # camera cropping itself are returned as they are
+    def Crop(self, frame):
+        roi = self.roi
+        if not roi or self.hw_roi:
+            return  frame
+        x0, y0, width, height = roi
+        return  frame[y0:y0 + height, x0:x0 + width]
     
+# opens all indices at once on their own threads, returns (index, opened
+# cv2.VideoCapture) of the first in the list which works, (None, None) if none
+# did in timeout seconds. an index is taken as soon as all before it failed,
+# on timeout the first of those which opened. a missing device may take
+# seconds to fail, nobody waits for it: late probes release their captures
+def discover_camera(indices, timeout=3.0):
+    results = queue.Queue()
+    claim = threading.Lock()
+    decided = []
+
+    def probe(index):
+        cap = cv2.VideoCapture(index)
+        if not cap.isOpened():
+            cap.release()
+            cap = None
+        with claim:
+            if not decided:
+                results.put((index, cap))
+                return
+        if cap is not None:
+            cap.release()  # too late
+
+    # first index which opened with nothing undecided before it, None - wait on
+    def choose(found, final):
+        for index in indices:
+            if found.get(index) is not None:
+                return  index
+            if index not in found and not final:
+                return  None
+        return  None
+
+    log_level = set_cv2_log_level(0)  # missing devices are expected here
+    try:
+        for index in indices:
+            threading.Thread(target=probe, args=(index,), name=f"camplay-probe-{index}", daemon=True).start()
+        end = time.perf_counter() + timeout
+        found = {}  # index: cap or None if it failed
+        while choose(found, False) is None and len(found) < len(indices):
+            try:
+                index, cap = results.get(timeout=max(end - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            found[index] = cap
+        with claim:
+            decided.append(True)
+            while not results.empty():
+                index, cap = results.get_nowait()
+                found[index] = cap
+        chosen = choose(found, True)
+        for index, cap in found.items():
+            if cap is not None and index != chosen:
+                cap.release()
+        if chosen is None:
+            return  None, None
+        if verbose: print(f"camera {chosen} found in {timeout - (end - time.perf_counter()):.2f} s")
+        return  chosen, found[chosen]
+    finally:
+        set_cv2_log_level(log_level)
+
+# returns the previous level. newer cv2 has these only in cv2.utils.logging
+def set_cv2_log_level(level):
+    logging = cv2 if hasattr(cv2, 'setLogLevel') else cv2.utils.logging
+    previous = logging.getLogLevel()
+    logging.setLogLevel(level)
+    return  previous
+
+def load_caps_cache():
+    try:
+        with open(caps_cache_path) as f:
+            return  json.load(f)
+    except (OSError, ValueError):
+        return  {}
+
+def save_caps_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(caps_cache_path), exist_ok=True)
+        tmp_path = caps_cache_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, caps_cache_path)  # never a half-written cache
+    except OSError as e:
+        print("saving camera capabilities exception: ", str(e))
+
+def fourcc_str(value):
+    value = int(value)
+    return  "".join(chr((value >> 8 * i) & 0xFF) for i in range(4)) if value > 0 else ""
+
+# tries every resolution with every pixel format on opened cv2.VideoCapture,
+# keeps what really works: the camera reports back the same size and delivers
+# a frame of that size. returns {"WxH": {fourcc: fps}}, camera settings are restored
+def probe_camera(cap, resolutions, formats=('MJPG', 'YUYV')):
+    saved = [(prop, cap.get(prop)) for prop in (cv2.CAP_PROP_CONVERT_RGB, cv2.CAP_PROP_FOURCC,
+                                                 cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT)]
+    cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)  # raw MJPG capture gives jpeg bytes, see CameraCV2.ReadCompressed
+    found = {}
+    # format is taken only if the camera reports it back, otherwise one pass as is
+    passes = [f for f in formats if cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*f))
+              and fourcc_str(cap.get(cv2.CAP_PROP_FOURCC)) == f] or [None]
+    for fmt in passes:
+        if fmt:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fmt))
+        for res in resolutions:
+            width, height = map(int, res.split('x'))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))) != (width, height):
+                continue
+            ret, frame = cap.read()
+            if ret and frame is not None and frame.ndim < 3 and frame.size:
+                frame = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_COLOR)  # backend kept it raw
+            if not ret or frame is None or frame.shape[:2] != (height, width):
+                continue
+            found.setdefault(res, {})[fmt or fourcc_str(cap.get(cv2.CAP_PROP_FOURCC)) or "default"] = cap.get(cv2.CAP_PROP_FPS)
+    for prop, value in saved:
+        cap.set(prop, value)
+    return  found
+
+# synthetic frames of given resolution and rate, no device needed.
+# a moving box and the frame number on a noisy gradient, so frames differ
+# and compress like real ones. fps=0 means as fast as possible
+class CameraSynthetic(CameraCV2):
+    def __init__(self, resolution=(1280, 720), fps=30, start=False):
+        super().__init__(f"synth:{resolution[0]}x{resolution[1]}@{fps}")
+        self.fps = fps
+        self.width, self.height = resolution
+        self.base = None
+        self.count = 0
+        self.next_time = None
+        if start:
+            self.Open()
+
+    def Open(self, idx=None):
+        self.id = self.idx
+        self._make_base()
+        self.next_time = time.perf_counter()
+
+    def _make_base(self):
+        gradient = np.linspace(0, 200, self.width, dtype=np.uint8)
+        self.base = np.empty((self.height, self.width, 3), np.uint8)
+        self.base[:] = gradient[None, :, None]
+        noise = cv2.randn(np.empty_like(self.base), 0, 12)
+        cv2.add(self.base, noise, dst=self.base)
+
+    def IsOpen(self):
+        return  self.base is not None
+
+    def Close(self):
+        self.base = None
+        self.id = None
+
+    def GetResolution(self):
+        return  self.width, self.height
+
+    def SetResolution(self, width, height):
+        self.width, self.height = int(width), int(height)
+        if self.base is not None:
+            self._make_base()
+        return  True
+
+    def Read(self, buf=None):
+        if self.base is None:
+            return  False, None
+        if self.fps:
+            # paced like a real camera
+            self.next_time += 1 / self.fps
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.next_time = time.perf_counter()  # we are late, don't try to catch up
+        if buf is not None and buf.shape == self.base.shape:
+            frame = buf
+            np.copyto(frame, self.base)
+        else:
+            frame = self.base.copy()
+        box = max(self.height // 8, 4)
+        x = (self.count * 7) % max(self.width - box, 1)
+        y = (self.count * 3) % max(self.height - box, 1)
+        cv2.rectangle(frame, (x, y), (x + box, y + box), (40, 200, 255), -1)
+        cv2.putText(frame, str(self.count), (10, self.height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+        self.count += 1
+        return  True, frame
+
+    def GetFPS(self):
+        return  self.fps
+
+    def GetCapabilities(self, resolutions=None, probe=True, reprobe=False):
+        return  None  # any resolution
+
+# video file as a camera, loops at the end. paced to file's fps unless
+# pace=False. SetResolution is emulated by resizing
+class CameraFile(CameraCV2):
+    def __init__(self, filepath, pace=True, start=False):
+        super().__init__(filepath)
+        self.pace = pace
+        self.size = None   # requested (width, height), None - as in the file
+        self.next_time = None
+        if start:
+            self.Open()
+
+    def Open(self, idx=None):
+        self.cap = cv2.VideoCapture(self.idx)
+        self.id = self.idx
+        self.next_time = time.perf_counter()
+
+    def GetResolution(self):
+        if self.size:
+            return  self.size
+        return  super().GetResolution()
+
+    def SetResolution(self, width, height):
+        self.size = (int(width), int(height))
+        return  True
+
+    def GetCapabilities(self, resolutions=None, probe=True, reprobe=False):
+        return  None  # any resolution, by resizing
+
+    def Read(self, buf=None):
+        # with emulated resolution the resize goes into buf, not the read
+        read_buf = buf if not self.size else None
+        ret, frame = self.cap.read(image=read_buf) if read_buf is not None else self.cap.read()
+        if not ret:
+            # end of file, from the beginning
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+            if not ret:
+                return  False, None
+        fps = self.GetFPS()
+        if self.pace and fps:
+            self.next_time += 1 / fps
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.next_time = time.perf_counter()
+        if self.size and (frame.shape[1], frame.shape[0]) != self.size:
+            if buf is not None and (buf.shape[1], buf.shape[0]) == self.size and buf.shape[2:] == frame.shape[2:]:
+                frame = cv2.resize(frame, self.size, dst=buf)
+            else:
+                frame = cv2.resize(frame, self.size)
+        return  True, frame
+
+# recorded video for reviewing, with everything a camera has (zoom, snapshots,
+# frame_proc...) plus Seek/Step/Pause. on the first open the file is indexed:
+# timestamps and keyframes from packets, without decoding, saved next to the
+# capabilities cache. a seek decodes from the nearest keyframe before the
+# target, never from far away, and decoded frames stay in an LRU cache, so
+# stepping back and forth is mostly free. stops at the end, doesn't loop
+class CameraPlayback(CameraFile):
+    def __init__(self, filepath, pace=True, start=False, cache_mb=None):
+        self.index = None     # {'frames', 'fps', 'stamps': [ms], 'keyframes': [n] or None}
+        self.cache = OrderedDict()  # frame number: decoded frame, most recent last
+        self.cache_bytes = 0
+        self.cache_limit = int((cache_mb or playback_cache_mb) * 2**20)
+        self.lock = threading.Lock()  # position vs Read on grabber thread
+        self.position = 0     # frame Read returns next, unless paused with no seek pending
+        self.pending = False  # Seek set position, Read hasn't shown it yet
+        self.shown = None     # frame Read returned last
+        self.decoded = None   # frame the decoder gives on the next cap.read()
+        self.paused = False
+        self.changed = threading.Event()  # seek or unpause, wakes a paused Read
+        super().__init__(filepath, pace=pace, start=start)
+
+    def Open(self, idx=None):
+        super().Open(idx)
+        self.decoded = 0
+        if self.cap.isOpened() and not self.index:
+            self.index = load_video_index(self.idx)
+
+    def Close(self):
+        super().Close()
+        self.cache.clear()
+        self.cache_bytes = 0
+
+    def GetFPS(self):
+        return  (self.index and self.index['fps']) or super().GetFPS()
+
+    def GetFrameCount(self):
+        return  self.index['frames'] if self.index else 0
+
+    # returns (frame number, its time in seconds) of the frame shown last
+    def GetPosition(self):
+        n = self.shown or 0
+        return  n, self.GetTime(n)
+
+    # time of frame n in seconds
+    def GetTime(self, n):
+        stamps = self.index['stamps'] if self.index else None
+        return  stamps[n] / 1000 if stamps and n < len(stamps) else n / (self.GetFPS() or 30)
+
+    # shows frame n next, paused or not. returns the frame number, within the file
+    def Seek(self, n):
+        with self.lock:
+            self.position = min(max(int(n), 0), max(self.GetFrameCount() - 1, 0))
+            self.pending = True
+            position = self.position
+        self.changed.set()
+        return  position
+
+    def SeekTime(self, seconds):
+        stamps = self.index['stamps'] if self.index else None
+        if stamps:
+            return  self.Seek(max(bisect.bisect_right(stamps, seconds * 1000) - 1, 0))
+        return  self.Seek(seconds * (self.GetFPS() or 30))
+
+    # frames forward or back from the shown one (or from a seek not shown yet), pauses
+    def Step(self, count=1):
+        self.paused = True
+        with self.lock:
+            base = self.position if self.pending else (self.shown or 0)
+        return  self.Seek(base + count)
+
+    def Pause(self, paused=None):
+        self.paused = not self.paused if paused is None else paused
+        self.changed.set()
+
+    def Read(self, buf=None):
+        if self.cap is None or not self.cap.isOpened():
+            return  False, None
+        fps = self.GetFPS()
+        if self.paused:
+            # shown frame again, a few times a second or right after a seek
+            self.changed.wait(0.1)
+            self.changed.clear()
+        elif self.pace and fps:
+            self.next_time += 1 / fps
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.next_time = time.perf_counter()
+        with self.lock:
+            # paused: the shown frame again, unless there was a seek
+            n = self.shown if self.paused and not self.pending and self.shown is not None else self.position
+            self.pending = False
+        frame = self._frame(n)
+        if frame is None:
+            # the end, it stays there
+            self.paused = True
+            n = self.shown if self.shown is not None else 0
+            frame = self._frame(n)
+            if frame is None:
+                return  False, None
+        with self.lock:
+            if not self.pending:
+                self.position = n + 1  # unless a seek came meanwhile
+            self.shown = n
+        # cached frames are shared, the pipeline may draw on what it gets
+        if self.size and (frame.shape[1], frame.shape[0]) != self.size:
+            return  True, cv2.resize(frame, self.size)
+        if buf is not None and buf.shape == frame.shape:
+            np.copyto(buf, frame)
+            return  True, buf
+        return  True, frame.copy()
+
+    def _frame(self, n):
+        frame = self.cache.get(n)
+        if frame is not None:
+            self.cache.move_to_end(n)
+            return  frame
+        keyframes = self.index['keyframes'] if self.index else None
+        if n != self.decoded:
+            if keyframes:
+                # from the keyframe before, unless the decoder is already on the way
+                key = keyframes[max(bisect.bisect_right(keyframes, n) - 1, 0)]
+                if not (self.decoded is not None and key <= self.decoded < n):
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+                    self.decoded = key
+            else:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, n)  # no index, backend seeks
+                self.decoded = n
+        frame = None
+        while self.decoded <= n:
+            ret, frame = self.cap.read()
+            if not ret:
+                self.decoded = None
+                return  None
+            self._cache(self.decoded, frame)
+            self.decoded += 1
+        return  frame
+
+    def _cache(self, n, frame):
+        self.cache[n] = frame
+        self.cache_bytes += frame.nbytes
+        while self.cache_bytes > self.cache_limit and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.cache_bytes -= old.nbytes
+
+# {'frames', 'fps', 'stamps', 'keyframes'} of a video file, built once and kept
+# in the cache folder while the file's size and time stay the same
+def load_video_index(filepath):
+    stat = os.stat(filepath)
+    path = os.path.abspath(filepath)
+    cache_path = os.path.join(os.path.dirname(caps_cache_path), "index",
+                              os.path.basename(path) + "_" + hashlib.sha1(path.encode()).hexdigest()[:12] + ".json")
+    try:
+        with open(cache_path) as f:
+            index = json.load(f)
+        if index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime:
+            return  index
+    except (OSError, ValueError):
+        pass
+    started = time.perf_counter()
+    index = build_video_index(filepath)
+    index['size'], index['mtime'] = stat.st_size, stat.st_mtime
+    if verbose: print(f"indexed {filepath}: {index['frames']} frames in {time.perf_counter() - started:.2f} s")
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError as e:
+        print("saving video index exception: ", str(e))
+    return  index
+
+# reads packets only, no decoding (ffmpeg backend). keyframes is None if the
+# backend can't tell them, then seeking is left to it
+def build_video_index(filepath):
+    cap = cv2.VideoCapture(filepath, cv2.CAP_FFMPEG)
+    raw = cap.isOpened() and cap.set(cv2.CAP_PROP_FORMAT, -1)
+    if not raw:
+        cap.release()
+        cap = cv2.VideoCapture(filepath)  # decoding, slower, but timestamps are there
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    stamps, keyframes = [], []
+    key_prop = getattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME', None)
+    while cap.grab():
+        if raw and key_prop is not None and cap.get(key_prop):
+            keyframes.append(len(stamps))
+        stamps.append(round(cap.get(cv2.CAP_PROP_POS_MSEC), 3))
+    cap.release()
+    return  {'frames': len(stamps), 'fps': fps, 'stamps': stamps, 'keyframes': keyframes or None}
+
+# recycles frame-sized arrays per role ('capture', 'view'...). a buffer is
+# handed out again only when nobody holds it, or a view of it, anymore, so
+# recorder, display and sinks don't have to give anything back: they just
+# drop their references. size change of a role drops its old buffers.
+# the pool keeps plain memory blocks and hands out arrays over them. numpy
+# points views' base at the first array over foreign memory, so every view
+# keeps the handed out array alive, and a weak reference to it says when the
+# block is free. no reference count guessing
+class FramePool:
+    def __init__(self, max_buffers=16):
+        self.max_buffers = max_buffers  # per role, more busy than that - plain allocation
+        self.lock = threading.Lock()
+        self.roles = {}       # role: (shape, dtype, [[block, weakref to its array]])
+        self.allocated = 0    # arrays created by the pool
+        self.reused = 0       # arrays handed out again
+
+    def Get(self, role, shape, dtype=None):
+        shape = tuple(shape)
+        dtype = dtype or np.uint8
+        with self.lock:
+            entry = self.roles.get(role)
+            if not entry or entry[0] != shape or entry[1] != dtype:
+                entry = self.roles[role] = (shape, dtype, [])
+            blocks = entry[2]
+            for block in blocks:
+                if block[1]() is None:
+                    self.reused += 1
+                    return  self._lend(block, shape, dtype)
+            self.allocated += 1
+            if len(blocks) >= self.max_buffers:
+                return  np.empty(shape, dtype)
+            block = [bytearray(int(np.prod(shape)) * np.dtype(dtype).itemsize), None]
+            blocks.append(block)
+            return  self._lend(block, shape, dtype)
+
+    def _lend(self, block, shape, dtype):
+        buf = np.ndarray(shape, dtype, buffer=block[0])
+        block[1] = weakref.ref(buf)
+        return  buf
+
+    # returns (allocated, reused)
+    def GetStats(self):
+        return  self.allocated, self.reused
+
+# reads camera on its own thread, keeps only the latest frame.
+# UI (or anybody else) picks up the newest one, stale frames are dropped,
+# so capture runs at camera's rate no matter how slow rendering is
+class FrameGrabber:
+    def __init__(self, cam, start=False, pool=None):
+        self.cam = cam
+        self.pool = pool      # FramePool, frames are read into its buffers
+        self.cam_lock = threading.RLock()  # serializes device access: Read vs Open/Close/SetResolution
+        self.lock = threading.Lock()       # guards the latest-frame slot below
+        self.new_frame = threading.Condition(self.lock)  # notified on every frame
+        self.seq = 0          # sequence number of the latest frame, 0 - nothing yet
+        self.frame = None     # ROI of the camera, see CameraCV2.Crop
+        self.full = None      # the whole frame self.frame is a view of
+        self.stamp = None     # time.perf_counter() when frame was read
+        self.sinks = []       # (sink, full) called on grabber thread for every frame, see AddSink()
+        self.packet_sinks = []  # same for compressed packets, see AddPacketSink()
+        self.profiler = None  # FrameProfiler, gets read timings
+        # compressed capture: packets are decoded on these threads, and only
+        # while somebody asks for frames or there are sinks
+        self.decoder = None
+        self.decoding = 0     # decodes in flight
+        self.demand = 0       # when frames were asked for the last time
+        self.wake = threading.Event()  # somebody wants frames again, see _wanted
+        self.running = False
+        self.thread = None
+        if start:
+            self.Start()
+
+    def Start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="camplay-grabber", daemon=True)
+        self.thread.start()
+
+    def Stop(self):
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        if self.decoder:
+            self.decoder.shutdown(wait=True)
+            self.decoder = None
+
+    # use as 'with grabber.Device():' around anything touching the camera
+    def Device(self):
+        return  self.cam_lock
+
+    # returns (seq, frame, stamp), seq changes only when a new frame arrived.
+    # frame is camera's ROI, or the whole frame if full
+    def GetLatest(self, full=False):
+        self._demand()
+        with self.lock:
+            return  self.seq, self.full if full else self.frame, self.stamp
+
+    # waits until there is a frame newer than last_seq, returns (seq, frame, stamp),
+    # on timeout seq is still last_seq
+    def WaitNew(self, last_seq, timeout=None, full=False):
+        self._demand()
+        with self.new_frame:
+            self.new_frame.wait_for(lambda: self.seq != last_seq, timeout)
+            return  self.seq, self.full if full else self.frame, self.stamp
+
+    # sink(seq, frame, stamp) gets every captured frame, on grabber thread.
+    # it must be quick and must not modify the frame (copy if needed),
+    # returning False unsubscribes it. full - whole frames instead of ROI
+    def AddSink(self, sink, full=False):
+        with self.lock:
+            self.sinks.append((sink, full))
+        self.wake.set()
+
+    def RemoveSink(self, sink):
+        with self.lock:
+            self.sinks = [s for s in self.sinks if s[0] != sink]
+
+    # sink(seq, packet, stamp) gets every compressed packet (jpeg bytes) as it came
+    # from the camera, without decoding. same rules as for AddSink
+    def AddPacketSink(self, sink):
+        with self.lock:
+            self.packet_sinks.append(sink)
+        self.wake.set()
+
+    def RemovePacketSink(self, sink):
+        with self.lock:
+            if sink in self.packet_sinks:
+                self.packet_sinks.remove(sink)
+
+    def _demand(self):
+        self.demand = time.perf_counter()
+        self.wake.set()
+
+    # frames are read only for sinks (recording, stream, paced window) or for
+    # somebody who asked in the last second, a paused window doesn't read the camera
+    def _wanted(self):
+        return  self.sinks or self.packet_sinks or time.perf_counter() - self.demand < 1.0
+
+    def _run(self):
+        captured = 0
+        while self.running:
+            if not self._wanted():
+                self.wake.wait(0.5)
+                self.wake.clear()
+                continue
+            start = time.perf_counter()
+            with self.cam_lock:
+                if self.cam and self.cam.IsOpen():
+                    compressed = self.cam.IsCompressed() if hasattr(self.cam, 'IsCompressed') else False
+                    if compressed:
+                        ret, frame = self.cam.ReadCompressed()
+                    else:
+                        # the same few buffers go round, the size is the last frame's
+                        shape = self.full.shape if self.full is not None else None
+                        buf = self.pool.Get('capture', shape) if self.pool and shape else None
+                        ret, frame = self.cam.Read(buf)
+                else:
+                    ret, frame = False, None
+            if not ret:
+                time.sleep(0.01)  # camera is closed or glitched, don't spin
+                continue
+            stamp = time.perf_counter()
+            captured = max(captured, self.seq) + 1
+            if self.profiler:
+                self.profiler.Capture(captured, stamp, stamp - start)
+            if frame.ndim < 3:
+                self._packet(captured, frame, stamp)
+            else:
+                self._publish(captured, frame, stamp)
+
+    # compressed packet: to packet sinks as is, decoded only if somebody needs it
+    def _packet(self, seq, packet, stamp):
+        with self.lock:
+            packet_sinks, wanted = list(self.packet_sinks), bool(self.sinks)
+        for sink in packet_sinks:
+            if sink(seq, packet, stamp) is False:
+                self.RemovePacketSink(sink)
+        wanted = wanted or time.perf_counter() - self.demand < 0.5
+        if not wanted:
+            return
+        if not self.decoder:
+            self.decoder = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="camplay-decode")
+        with self.lock:
+            if self.decoding >= 2 * decode_workers:
+                return  # decoders are behind, this one is skipped
+            self.decoding += 1
+        self.decoder.submit(self._decode, seq, packet, stamp)
+
+    def _decode(self, seq, packet, stamp):
+        try:
+            frame = cv2.imdecode(packet, cv2.IMREAD_COLOR)  # releases the GIL, decoders run in parallel
+            if frame is not None:
+                self._publish(seq, frame, stamp)
+        finally:
+            with self.lock:
+                self.decoding -= 1
+
+    def _publish(self, seq, full, stamp):
+        frame = self.cam.Crop(full)
+        with self.lock:
+            if seq > self.seq:  # parallel decoders may finish out of order, older frame is stale
+                self.seq = seq
+                self.frame = frame
+                self.full = full
+                self.stamp = stamp
+                self.new_frame.notify_all()
+            sinks = list(self.sinks)
+        for sink, whole in sinks:
+            if sink(seq, full if whole else frame, stamp) is False:
+                self.RemoveSink(sink)
+
 # recors video, frame by frame after setup
+# encoding runs on its own thread which owns cv2.VideoWriter, frames come
+# through a bounded queue. when the encoder falls behind the policy decides:
+#   'block'       - caller waits for a free slot (no frame lost)
+#   'drop-oldest' - the oldest queued frame is thrown away
+#   'drop-newest' - the incoming frame is thrown away
 class RecorderCV2:
-    pass
+    policies = ('block', 'drop-oldest', 'drop-newest')
+
+    def __init__(self, queue_size=32, policy='drop-oldest'):
+        if policy not in self.policies:
+            raise ValueError(f"unknown recorder policy: {policy}, use one of {self.policies}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.writer = None
+        self.queue = None
+        self.thread = None
+        self.filepath = None
+        self.size = None     # (width, height) of the video
+        self.encoded = 0     # frames written into the file
+        self.dropped = 0     # frames lost because encoder was behind
+        self.preroll = None  # [(stamp, jpeg)] written ahead of live frames
+        self.passthrough = False  # frames are jpeg bytes, see AviMjpegWriter
+        self.process = None  # process(frame) -> frame on the encoder thread, before writing
+        # segmented recording: files roll over by video time or size, the next
+        # one is opened ahead and the finished one closed on the background thread
+        self.segment_frames = None
+        self.segment_bytes = None
+        self.budget = None   # bytes record folder may take, see prune_recordings
+        self.segments = 0    # files written so far
+        self.closing = set() # finished segments waiting for _finish
+        self.background = None
+
+    # size is (width, height), raises on failure.
+    # preroll is what PreRollBuffer.Take() returned, it goes first.
+    # passthrough: Write() gets jpeg bytes, they go into avi as they are.
+    # process(frame) -> frame runs on the encoder thread for every frame, pre-roll
+    # too, so processing keeps up with capture as long as encoding does.
+    # it must not modify the frame it gets (copy first)
+    # with segment_seconds or segment_mb files are name_000.ext, name_001.ext...
+    # budget_mb: oldest recordings in the folder are deleted when it's bigger
+    def Open(self, filepath, fourcc, fps, size, preroll=None, passthrough=False,
+             segment_seconds=None, segment_mb=None, budget_mb=None, process=None):
+        self.Close()
+        self.passthrough = passthrough
+        self.process = None if passthrough else process
+        self.fourcc, self.fps = fourcc, fps
+        self.size = tuple(size)
+        self.basepath = filepath
+        self.segment_frames = max(int(segment_seconds * fps), 1) if segment_seconds else None
+        self.segment_bytes = int(segment_mb * 2**20) if segment_mb else None
+        self.budget = int(budget_mb * 2**20) if budget_mb else None
+        self.segments = 1
+        self.filepath = self._segment_path(0)
+        writer = self._open_writer(self.filepath)
+        self.encoded, self.dropped = 0, 0
+        self.preroll = preroll
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camplay-segments")
+        self.thread = threading.Thread(target=self._run, args=(writer,), name="camplay-recorder", daemon=True)
+        self.thread.start()
+        self.writer = writer  # last, Write() checks it. the thread owns it from now on
+
+    def _segment_path(self, index):
+        if not (self.segment_frames or self.segment_bytes):
+            return  self.basepath
+        base, ext = os.path.splitext(self.basepath)
+        return  f"{base}_{index:03d}{ext}"
+
+    def _open_writer(self, filepath):
+        if self.passthrough:
+            writer = AviMjpegWriter(filepath, self.fps, self.size)
+        else:
+            writer = cv2.VideoWriter(filepath, self.fourcc, self.fps, self.size)
+        if not writer.isOpened():
+            raise RuntimeError(f"can't open video writer for {filepath}")
+        return  writer
+
+    def IsOpen(self):
+        return  self.writer is not None
 
+    # queues frame for encoding, returns False if the frame was dropped.
+    # note: frame must not be modified after this call
+    def Write(self, frame):
+        if not self.writer:
+            return  False
+        if self.policy == 'block':
+            self.queue.put(frame)
+            return  True
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return  True
+            except queue.Full:
+                if self.policy == 'drop-newest':
+                    self.dropped += 1
+                    return  False
+            try:  # drop-oldest
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass  # writer just took it, try again
+
+    # flushes what is queued and closes the file
+    def Close(self):
+        if not self.writer:
+            return
+        self.queue.put(None)  # end marker, always waits
+        self.thread.join()
+        self.background.shutdown(wait=True)  # segments closed, synced and pruned
+        self.background = None
+        self.writer = None
+        self.thread = None
+
+    # returns (encoded, dropped, queued)
+    def GetStats(self):
+        return  self.encoded, self.dropped, (self.queue.qsize() if self.queue else 0)
+
+    def _run(self, writer):
+        # pre-roll is decoded here, off the caller's thread. live frames wait in the queue
+        for stamp, jpeg in self.preroll or []:
+            self._write(writer, jpeg if self.passthrough else cv2.imdecode(jpeg, cv2.IMREAD_COLOR))
+        count = len(self.preroll or [])  # frames in the current segment
+        self.preroll = None
+        segmented = self.segment_frames or self.segment_bytes
+        path, upcoming = self.filepath, None  # upcoming: future with the next segment's writer
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if segmented and not upcoming:
+                upcoming = self.background.submit(self._open_writer, self._segment_path(self.segments))
+            if segmented and count and self._segment_full(count, path):
+                try:
+                    next_writer = upcoming.result()  # opened long ago, no wait here
+                except Exception as e:
+                    print("opening next segment exception: ", str(e), ", still writing ", path)
+                else:
+                    self.closing.add(path)
+                    self.background.submit(self._finish, writer, path)
+                    writer, path, count = next_writer, self._segment_path(self.segments), 0
+                    self.filepath = path
+                    self.segments += 1
+                upcoming = None
+            self._write(writer, frame)
+            count += 1
+        if upcoming:
+            # opened ahead but not needed, empty file goes away
+            try:
+                upcoming.result().release()
+                os.remove(self._segment_path(self.segments))
+            except Exception:
+                pass
+        self.closing.add(path)
+        self.background.submit(self._finish, writer, path)
+
+    def _segment_full(self, count, path):
+        if self.segment_frames and count >= self.segment_frames:
+            return  True
+        # file size lags behind encoder's buffers, no need to ask every frame
+        if self.segment_bytes and count % 16 == 0:
+            try:
+                return  os.path.getsize(path) >= self.segment_bytes
+            except OSError:
+                return  False
+        return  False
+
+    # on background thread: close, make sure it's on disk, keep the folder in budget
+    def _finish(self, writer, path):
+        writer.release()
+        try:
+            with open(path, 'rb+') as f:
+                os.fsync(f.fileno())
+        except OSError as e:
+            print("syncing video file exception: ", str(e))
+        if self.budget:
+            # nothing the recorder still has: the current, the pre-opened next and closing ones
+            keep = (self.filepath, self._segment_path(self.segments)) + tuple(self.closing)
+            prune_recordings(os.path.dirname(path) or '.', self.budget, keep=keep)
+        self.closing.discard(path)
+
+    def _write(self, writer, frame):
+        if self.process:
+            try:
+                frame = self.process(frame)
+            except Exception as e:
+                print("recording frame processing exception: ", str(e))
+        if not self.passthrough and (frame.shape[1], frame.shape[0]) != self.size:
+            # resolution changed while recording, writer can't change on the fly
+            frame = cv2.resize(frame, self.size)
+        writer.write(frame)
+        self.encoded += 1
+
+# deletes the oldest recordings (video_*) until the whole folder fits into
+# budget bytes. other files count but are never deleted, neither are keep ones
+def prune_recordings(folder, budget, keep=()):
+    keep = {os.path.abspath(p) for p in keep}
+    total, videos = 0, []
+    for entry in os.scandir(folder):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        total += stat.st_size
+        if entry.name.startswith("video_") and os.path.abspath(entry.path) not in keep:
+            videos.append((stat.st_mtime, entry.path, stat.st_size))
+    for mtime, path, size in sorted(videos):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            if verbose: print("recording deleted, over budget: ", path)
+        except OSError as e:
+            print("deleting recording exception: ", str(e))
+
+# minimal MJPEG AVI writer, takes jpeg bytes as they are, so camera's MJPG
+# can be recorded without decoding and encoding again. same methods as
+# cv2.VideoWriter. plain AVI 1.0, keep files under 1 GB
+class AviMjpegWriter:
+    def __init__(self, filepath, fps, size):
+        self.file = open(filepath, 'wb')
+        self.fps = fps
+        self.size = tuple(size)
+        self.index = []       # (offset in movi, size)
+        self.max_chunk = 0
+        self._write_headers()
+
+    def _write_headers(self):
+        width, height = self.size
+        frames = len(self.index)
+        usec = int(1000000 / self.fps) if self.fps else 0
+        avih = struct.pack('<14I', usec, 0, 0, 0x10, frames, 0, 1, self.max_chunk, width, height, 0, 0, 0, 0)
+        strh = struct.pack('<4s4sIHHIIIIIIIIhhhh', b'vids', b'MJPG', 0, 0, 0, 0,
+                           1000, int(round(self.fps * 1000)), 0, frames, self.max_chunk, 0xFFFFFFFF, 0,
+                           0, 0, width, height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+        strl = b'strl' + self._chunk(b'strh', strh) + self._chunk(b'strf', strf)
+        hdrl = b'hdrl' + self._chunk(b'avih', avih) + self._chunk(b'LIST', strl)
+        self.file.seek(0)
+        self.file.write(b'RIFF' + struct.pack('<I', 0) + b'AVI ')
+        self.file.write(self._chunk(b'LIST', hdrl))
+        self.movi_start = self.file.tell()
+        self.file.write(b'LIST' + struct.pack('<I', 0) + b'movi')
+
+    def _chunk(self, fourcc, data):
+        return  fourcc + struct.pack('<I', len(data)) + data + (b'\0' if len(data) % 2 else b'')
+
+    def isOpened(self):
+        return  self.file is not None
+
+    def write(self, jpeg):
+        data = jpeg.tobytes() if hasattr(jpeg, 'tobytes') else bytes(jpeg)
+        offset = self.file.tell() - (self.movi_start + 8)  # idx1 counts from 'movi'
+        self.file.write(self._chunk(b'00dc', data))
+        self.index.append((offset, len(data)))
+        self.max_chunk = max(self.max_chunk, len(data))
+
+    def release(self):
+        if not self.file:
+            return
+        movi_end = self.file.tell()
+        idx = b''.join(struct.pack('<4sIII', b'00dc', 0x10, offset, size) for offset, size in self.index)
+        self.file.write(self._chunk(b'idx1', idx))
+        end = self.file.tell()
+        # sizes and frame counts are known only now
+        self._write_headers()
+        self.file.seek(self.movi_start + 4)
+        self.file.write(struct.pack('<I', movi_end - self.movi_start - 8))
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', end - 8))
+        self.file.close()
+        self.file = None
+
+# lossless recording: raw BGR frames copied straight into a preallocated,
+# memory-mapped ring file, no encoding at all. layout:
+#   header (4 KB):  magic, version, width, height, channels, slots, data offset,
+#                   fps, frames written so far, wall time of opening
+#   index:          (seq, wall time) per slot
+#   data:           slots of width*height*channels bytes, 4 KB aligned
+# when full the oldest frames are overwritten. read back with RawRingReader,
+# transcode with transcode_raw()
+class RawRingWriter:
+    magic = b"CAMPRAW1"
+    header = struct.Struct('<8sIIIIIIdQd')
+    count_offset = 40      # of 'frames written' in the header
+    index_offset = 4096
+    index_dtype = [('seq', '<u8'), ('stamp', '<f8')]
+
+    def __init__(self):
+        self.lock = threading.Lock()  # Write from grabber thread vs Close
+        self.file = None
+        self.mm = None
+        self.index = None     # structured view of the index
+        self.slots = None     # (slots, height, width, channels) view of the data
+        self.filepath = None
+        self.count = 0        # frames written
+        self.dropped = 0      # frames of the wrong size
+        self.segments = 1     # for the same stats as RecorderCV2
+
+    # size is (width, height), raises on failure
+    def Open(self, filepath, fps, size, slots, channels=3):
+        self.Close()
+        width, height = map(int, size)
+        data_offset = -(-(self.index_offset + slots * 16) // 4096) * 4096
+        total = data_offset + slots * width * height * channels
+        file = open(filepath, 'w+b')
+        try:
+            file.truncate(total)
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(file.fileno(), 0, total)  # no ENOSPC in the middle of capture
+            mm = mmap.mmap(file.fileno(), total)
+        except Exception:
+            file.close()
+            raise
+        self.header.pack_into(mm, 0, self.magic, 1, width, height, channels, slots, data_offset, fps or 0, 0, time.time())
+        with self.lock:
+            self.file, self.mm = file, mm
+            self.index = np.ndarray((slots,), self.index_dtype, buffer=mm, offset=self.index_offset)
+            self.slots = np.ndarray((slots, height, width, channels), np.uint8, buffer=mm, offset=data_offset)
+            self.wall_offset = time.time() - time.perf_counter()  # stamps are perf_counter()
+            self.filepath = filepath
+            self.count, self.dropped = 0, 0
+
+    def IsOpen(self):
+        return  self.mm is not None
+
+    # copies frame into the next slot, returns False if it wasn't written
+    def Write(self, frame, seq=0, stamp=None):
+        with self.lock:
+            if self.mm is None:
+                return  False
+            if frame.shape != self.slots.shape[1:]:
+                self.dropped += 1  # resolution changed, slots can't
+                return  False
+            slot = self.count % len(self.slots)
+            np.copyto(self.slots[slot], frame)
+            self.index[slot] = (seq, (stamp if stamp is not None else time.perf_counter()) + self.wall_offset)
+            self.count += 1
+            struct.pack_into('<Q', self.mm, self.count_offset, self.count)  # readers see it only now
+            return  True
+
+    def Close(self):
+        with self.lock:
+            if self.mm is None:
+                return
+            self.index, self.slots = None, None  # views must go before the map
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+            self.mm, self.file = None, None
+
+    # returns (written, dropped, queued)
+    def GetStats(self):
+        return  self.count, self.dropped, 0
+
+# any frame of a raw ring file right away, even while it's being written.
+# frames are numbered from the start of recording, the file keeps GetRange()
+class RawRingReader:
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.width, self.height, self.channels, slots, data_offset,
+         self.fps, _, self.started) = RawRingWriter.header.unpack_from(self.mm, 0)
+        if magic != RawRingWriter.magic:
+            self.Close()
+            raise ValueError(f"not a camplay raw file: {filepath}")
+        self.index = np.ndarray((slots,), RawRingWriter.index_dtype, buffer=self.mm, offset=RawRingWriter.index_offset)
+        self.slots = np.ndarray((slots, self.height, self.width, self.channels), np.uint8,
+                                buffer=self.mm, offset=data_offset)
+
+    # returns (first, end) frame numbers still in the file
+    def GetRange(self):
+        count = struct.unpack_from('<Q', self.mm, RawRingWriter.count_offset)[0]
+        return  max(count - len(self.slots), 0), count
+
+    # returns (seq, wall time, frame), frame is a read-only view into the file
+    def GetFrame(self, n):
+        first, end = self.GetRange()
+        if not first <= n < end:
+            raise IndexError(f"frame {n} is not in the file, it has {first}..{end - 1}")
+        slot = n % len(self.slots)
+        seq, stamp = self.index[slot]
+        return  int(seq), float(stamp), self.slots[slot]
+
+    def Close(self):
+        self.index, self.slots = None, None
+        self.mm.close()
+        self.file.close()
+
+# encodes frames first..last-1 of a raw ring file into video_ext/codec_str
+# files, one part per worker, every part on its own core (cv2 encodes without
+# the GIL). returns paths of the parts
+def transcode_raw(filepath, first=None, last=None, folder=None, workers=None):
+    reader = RawRingReader(filepath)
+    try:
+        begin, end = reader.GetRange()
+        first = begin if first is None else max(first, begin)
+        last = end if last is None else min(last, end)
+        if last <= first:
+            print(f"nothing to transcode, the file has frames {begin}..{end - 1}")
+            return  []
+        workers = max(min(workers or os.cpu_count() or 1, last - first), 1)
+        step = -(-(last - first) // workers)
+        base = os.path.join(folder or os.path.dirname(filepath) or '.', os.path.splitext(os.path.basename(filepath))[0])
+        fourcc = cv2.VideoWriter_fourcc(*codec_str)
+
+        def encode(part):
+            start, stop = first + part * step, min(first + (part + 1) * step, last)
+            path = f"{base}_{part:03d}.{video_ext}"
+            writer = cv2.VideoWriter(path, fourcc, reader.fps or 30, (reader.width, reader.height))
+            if not writer.isOpened():
+                raise RuntimeError(f"can't open video writer for {path}")
+            for n in range(start, stop):
+                writer.write(reader.GetFrame(n)[2])
+            writer.release()
+            return  path
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="camplay-transcode") as pool:
+            return  list(pool.map(encode, range(workers)))
+    finally:
+        reader.Close()
+
+# keeps the last seconds of frames JPEG-compressed in RAM, so a recording can
+# start before Start was pressed: 30 s of 1080p take tens of MB instead of
+# gigabytes of raw BGR. frames are encoded on its own thread, when it can't keep
+# up an incoming frame is skipped. oldest frames go first, by age and by memory budget
+class PreRollBuffer:
+    def __init__(self, seconds=10, max_bytes=64 * 2**20, quality=85):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.frames = deque()   # (stamp, jpeg), oldest first
+        self.bytes = 0
+        self.skipped = 0        # frames the encoder couldn't take
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=2)
+        self.thread = threading.Thread(target=self._run, name="camplay-preroll", daemon=True)
+        self.thread.start()
+
+    # frame must not be modified after this call. a 1-d frame is jpeg already
+    def Put(self, frame, stamp=None):
+        try:
+            self.queue.put_nowait((stamp if stamp is not None else time.perf_counter(), frame))
+        except queue.Full:
+            self.skipped += 1
+
+    # hands over buffered frames, oldest first, and starts over
+    def Take(self):
+        self.queue.join()  # a couple of frames may be in the encoder
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+            self.bytes = 0
+        return  frames
+
+    # returns (frames, bytes, seconds) held now
+    def GetStats(self):
+        with self.lock:
+            span = self.frames[-1][0] - self.frames[0][0] if self.frames else 0
+            return  len(self.frames), self.bytes, span
+
+    def Close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            stamp, frame = item
+            ok, jpeg = (True, frame) if frame.ndim == 1 else cv2.imencode('.jpg', frame, params)
+            with self.lock:
+                if ok:
+                    self.frames.append((stamp, jpeg))
+                    self.bytes += jpeg.nbytes
+                while self.frames and (stamp - self.frames[0][0] > self.seconds or self.bytes > self.max_bytes):
+                    self.bytes -= self.frames.popleft()[1].nbytes
+            self.queue.task_done()
+
+
+# motion detection for unattended recording, tens of microseconds per frame
+# at 1080p: it looks at every step-th pixel of the green channel (a strided
+# copy, no resize and no colour conversion) and compares it with a running
+# average background. level is the share of pixels that changed.
+# hysteresis: becomes active when level > start_level, goes idle after level
+# stayed below stop_level for post_roll seconds, so recording doesn't flap
+class MotionDetector:
+    def __init__(self, start_level=0.01, stop_level=None, post_roll=5.0, width=160, threshold=25, alpha=0.05):
+        self.start_level = start_level
+        self.stop_level = stop_level if stop_level is not None else start_level * 0.4
+        self.post_roll = post_roll
+        self.width = width          # of the downscaled copy, about
+        self.threshold = threshold  # brightness change that counts
+        self.alpha = alpha          # how fast background follows the scene
+        self.background = None
+        self.level = 0.0
+        self.active = False
+        self.calm_since = None
+
+    # returns True while there is motion (including post-roll)
+    def Update(self, frame, stamp=None):
+        stamp = stamp if stamp is not None else time.perf_counter()
+        step = max(frame.shape[1] // self.width, 1)
+        small = np.ascontiguousarray(frame[::step, ::step, 1] if frame.ndim == 3 else frame[::step, ::step])
+        if self.background is None or self.background.shape != small.shape:
+            self.background = small.astype(np.float32)  # first frame or resolution changed
+            return  self.active
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        self.level = cv2.countNonZero(mask) / mask.size
+        cv2.accumulateWeighted(small, self.background, self.alpha)
+
+        if self.level > self.start_level:
+            self.active = True
+            self.calm_since = None
+        elif self.active and self.level < self.stop_level:
+            if self.calm_since is None:
+                self.calm_since = stamp
+            elif stamp - self.calm_since >= self.post_roll:
+                self.active = False
+        else:
+            self.calm_since = None  # in between levels, not calm yet
+        return  self.active
+
+# worker process of ProcPool: attaches to the shared memory once and
+# runs proc on frames right there, in place
+def _proc_worker(proc, tasks, results):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # parent decides when to stop
+    shm, shm_name = None, None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        name, shape, slot, seq, pos = task
+        if name != shm_name:
+            if shm:
+                shm.close()
+            shm, shm_name = _attach_shm(name), name
+        size = shape[0] * shape[1] * shape[2]
+        frame = np.ndarray(shape, np.uint8, buffer=shm.buf, offset=slot * size)
+        ok = True
+        try:
+            result = proc(frame, pos)
+            if result is not None and result is not frame:
+                frame[:] = result  # proc returned a new frame, must be the same size
+        except Exception as e:
+            print("frame_proc exception: ", str(e))
+            ok = False
+        del frame  # no exported views, or shm can't be closed
+        results.put((slot, seq, ok))
+    if shm:
+        shm.close()
+
+# workers share parent's resource tracker, the owner (ProcPool) unlinks
+def _attach_shm(name):
+    try:
+        return  shared_memory.SharedMemory(name=name, track=False)  # python 3.13+
+    except TypeError:
+        return  shared_memory.SharedMemory(name=name)
+
+# runs frame_proc(frame, pos) in worker processes, so heavy analysis uses all
+# cores instead of holding the UI thread under the GIL. frames go through slots
+# in one multiprocessing.shared_memory block, only slot numbers are pickled.
+# depth is how many frames may be in flight at once. results come back
+# 'ordered' (every frame, in capture order) or 'latest' (newest finished wins,
+# older ones are skipped). proc must be picklable, i.e. a module level function
+class ProcPool:
+    modes = ('ordered', 'latest')
+
+    def __init__(self, proc, workers=2, depth=None, mode='ordered'):
+        if mode not in self.modes:
+            raise ValueError(f"unknown order: {mode}, use one of {self.modes}")
+        self.proc = proc
+        self.depth = depth or workers * 2
+        self.mode = mode
+        self.shm = None
+        self.shape = None
+        self.free = []
+        self.stamps = {}       # seq -> capture stamp, of frames in flight
+        self.submitted = deque()  # seqs in submit order
+        self.finished = {}     # seq -> (slot, ok)
+        self.stale = set()     # seqs skipped by 'latest' while still in flight, see _collect
+        self.last_seq = 0      # of the last returned result
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        # workers must share our resource tracker, or each would start its own
+        # and unlink our shared memory when it exits
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+        self.workers = [multiprocessing.Process(target=_proc_worker, args=(proc, self.tasks, self.results),
+                                                name=f"camplay-proc-{i}", daemon=True) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def _allocate(self, shape):
+        self._drain()
+        self._release_shm()
+        size = shape[0] * shape[1] * shape[2]
+        self.shm = shared_memory.SharedMemory(create=True, size=size * self.depth)
+        self.shape = shape
+        self.free = list(range(self.depth))
+
+    def _slot(self, slot):
+        size = self.shape[0] * self.shape[1] * self.shape[2]
+        return  np.ndarray(self.shape, np.uint8, buffer=self.shm.buf, offset=slot * size)
+
+    # copies frame into a free slot and queues it, False if all slots are busy
+    def Submit(self, frame, pos, seq, stamp=None):
+        if frame.ndim != 3 or frame.dtype != np.uint8:
+            return  False
+        if frame.shape != self.shape:
+            self._allocate(frame.shape)  # first frame or resolution changed
+        self._collect()
+        if not self.free:
+            return  False
+        slot = self.free.pop()
+        np.copyto(self._slot(slot), frame)
+        self.stamps[seq] = stamp
+        self.submitted.append(seq)
+        self.tasks.put((self.shm.name, self.shape, slot, seq, pos))
+        return  True
+
+    def _collect(self, timeout=None):
+        while True:
+            try:
+                slot, seq, ok = self.results.get(timeout=timeout) if timeout else self.results.get_nowait()
+            except queue.Empty:
+                return
+            if seq in self.stale:
+                self.stale.discard(seq)
+                self.free.append(slot)  # nobody wants it anymore
+            else:
+                self.finished[seq] = (slot, ok)
+            timeout = None
+
+    # returns (seq, stamp, frame) of a processed frame or None if nothing is ready.
+    # frame is a copy, the slot goes back to the pool
+    def Get(self):
+        self._collect()
+        if self.mode == 'ordered':
+            if not self.submitted or self.submitted[0] not in self.finished:
+                return  None
+            seq = self.submitted.popleft()
+        else:
+            ready = [s for s in self.submitted if s in self.finished]
+            if not ready:
+                return  None
+            seq = ready[-1]
+            for older in [s for s in self.submitted if s < seq]:
+                if older in self.finished:
+                    self._recycle(older)  # latest wins
+                else:
+                    self.stale.add(older)  # its slot comes back when it's done
+                    self.stamps.pop(older, None)
+            self.submitted = deque(s for s in self.submitted if s > seq)
+        slot, ok = self.finished[seq]
+        frame = self._slot(slot).copy()
+        stamp = self.stamps.get(seq)
+        self._recycle(seq)
+        self.last_seq = seq
+        return  seq, stamp, frame
+
+    def _recycle(self, seq):
+        slot, ok = self.finished.pop(seq)
+        self.free.append(slot)
+        if seq in self.submitted:
+            self.submitted.remove(seq)
+        self.stamps.pop(seq, None)
+
+    # waits for frames in flight and throws them away
+    def _drain(self):
+        while len(self.finished) < len(self.submitted) or self.stale:
+            self._collect(timeout=1.0)
+        self.submitted.clear()
+        self.finished.clear()
+        self.stamps.clear()
+
+    def _release_shm(self):
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def Close(self):
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        self._release_shm()
+
+# saves snapshots on a small pool of threads, so png/tiff encoding
+# doesn't freeze the preview. file names never collide: they have
+# milliseconds and a running counter
+class SnapshotWriter:
+    def __init__(self, folder, ext, workers=2, verbose=False):
+        self.folder = folder
+        self.ext = ext
+        self.verbose = verbose
+        self.counter = itertools.count()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="camplay-snap")
+
+    # unique name like snapshot_2024-05-01_120000_123_0007, without extension
+    def MakeName(self, prefix="snapshot"):
+        now = datetime.now()
+        return  now.strftime(f"{prefix}_%Y-%m-%d_%H%M%S_") + f"{now.microsecond // 1000:03d}_{next(self.counter):04d}"
+
+    # queues frame for saving, returns file path. frame must not be modified after this call
+    def Save(self, frame, name=None):
+        filepath = os.path.join(self.folder, (name or self.MakeName()) + "." + self.ext)
+        self.pool.submit(self._write, filepath, frame)
+        return  filepath
+
+    # waits for all queued snapshots
+    def Close(self):
+        self.pool.shutdown(wait=True)
+
+    def _write(self, filepath, frame):
+        try:
+            if not cv2.imwrite(filepath, frame):
+                print("snapshot wasn't saved: ", filepath)
+            elif self.verbose:
+                print(f"Snapshot saved: {filepath}")
+        except Exception as e:
+            print("snapshot exception: ", str(e), ", file name: ", filepath)
+
+# grabs N consecutive frames (or all frames for T seconds) right from
+# the grabber thread, so none is lost to a slow UI. use as a FrameGrabber sink
+class BurstCapture:
+    def __init__(self, writer, count=10, duration=None):
+        self.writer = writer
+        self.count = count
+        self.duration = duration  # seconds, if set overrides count
+        self.name = writer.MakeName("burst")
+        self.taken = 0
+        self.start = None
+        self.done = threading.Event()
+
+    def IsDone(self):
+        return  self.done.is_set()
+
+    def __call__(self, seq, frame, stamp):
+        if self.start is None:
+            self.start = stamp
+        if self.duration is not None:
+            if stamp - self.start > self.duration:
+                self.done.set()
+                return  False
+        elif self.taken >= self.count:
+            self.done.set()
+            return  False
+        # copy, UI may draw on this frame
+        self.writer.Save(frame.copy(), name=f"{self.name}_{self.taken:04d}")
+        self.taken += 1
+        return  True
+
+# scores every frame for duration seconds by focus_score and saves only the
+# sharpest one, so it's encoded once. a FrameGrabber sink, like BurstCapture
+class BestSnapshot:
+    def __init__(self, writer, duration=1.0, pos=None):
+        self.writer = writer
+        self.duration = duration
+        self.pos = pos        # where focus matters, see focus_score
+        self.start = None
+        self.best = None      # (score, frame copy)
+        self.scored = 0
+        self.done = threading.Event()
+
+    def IsDone(self):
+        return  self.done.is_set()
+
+    def __call__(self, seq, frame, stamp):
+        if self.start is None:
+            self.start = stamp
+        if stamp - self.start > self.duration:
+            if self.best:
+                path = self.writer.Save(self.best[1], name=self.writer.MakeName("best"))
+                print(f"sharpest of {self.scored} frames, focus {self.best[0]:.1f}: {path}")
+            self.best = None
+            self.done.set()
+            return  False
+        score = focus_score(frame, self.pos)
+        self.scored += 1
+        if not self.best or score > self.best[0]:
+            self.best = (score, frame.copy())  # copy, the frame buffer goes round
+        return  True
+
+# MJPEG over HTTP for watching from other machines, asyncio on its own thread:
+#   /stream[?q=NN]    multipart/x-mixed-replace, for browsers and players
+#   /snapshot[?q=NN]  the latest frame as a single jpeg
+# every frame is encoded once per quality asked for, all clients get the same
+# bytes. slow clients skip frames: a client waits until its previous frame
+# is out of the socket buffer, then gets the newest one
+class StreamServer:
+    boundary = b"camplayframe"
+
+    def __init__(self, host='0.0.0.0', port=8080, quality=80):
+        self.host = host
+        self.port = port
+        self.quality = quality
+        self.latest = (0, None)  # (seq, frame) published last
+        self.jpegs = {}          # quality: (seq, jpeg bytes), shared by all clients
+        self.encoding = {}       # quality: (seq, task) encode in progress
+        self.clients = 0         # connected to /stream
+        self.sent = 0            # frames sent, all clients
+        self.loop = None
+        self.thread = None
+        self.tick = None         # future, done when a new frame is published
+        self.stopping = None
+        self.tasks = set()       # connection handlers, cancelled on Stop
+
+    # raises if the port can't be bound
+    def Start(self):
+        ready = threading.Event()
+        error = []
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._main(ready, error)),
+                                       name="camplay-http", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if error:
+            self.thread.join()
+            self.thread = None
+            raise error[0]
+        if verbose: print(f"streaming on http://{self.host}:{self.port}/stream")
+
+    def Stop(self):
+        if not self.thread:
+            return
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join(timeout=2)
+        self.thread = None
+
+    # grabber sink, any thread. encoding is done only when somebody asks
+    def Publish(self, seq, frame, stamp=None):
+        self.latest = (seq, frame)
+        if self.clients and self.loop:
+            self.loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        tick, self.tick = self.tick, self.loop.create_future()
+        tick.set_result(None)
+
+    async def _main(self, ready, error):
+        self.loop = asyncio.get_running_loop()
+        self.tick = self.loop.create_future()
+        self.stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            error.append(e)
+            ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]  # port 0 - any free one
+        ready.set()
+        async with server:
+            await self.stopping.wait()
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    # newest frame as jpeg, encoded once for everybody on a worker thread
+    async def _jpeg(self, quality):
+        seq, frame = self.latest
+        if frame is None:
+            return  None
+        cached = self.jpegs.get(quality)
+        if cached and cached[0] == seq:
+            return  cached[1]
+        running = self.encoding.get(quality)
+        if not running or running[0] != seq:
+            task = asyncio.ensure_future(self._encode(seq, frame, quality))
+            running = self.encoding[quality] = (seq, task)
+        return  await asyncio.shield(running[1])  # a client leaving doesn't cancel it for others
+
+    async def _encode(self, seq, frame, quality):
+        ok, jpeg = await self.loop.run_in_executor(None, cv2.imencode, ".jpg", frame,
+                                                   [cv2.IMWRITE_JPEG_QUALITY, quality])
+        data = jpeg.tobytes()
+        if seq >= self.jpegs.get(quality, (0,))[0]:
+            self.jpegs[quality] = (seq, data)
+        return  data
+
+    async def _handle(self, reader, writer):
+        self.tasks.add(asyncio.current_task())
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass  # headers aren't needed
+            parts = request.decode('latin-1').split()
+            path, _, query = (parts[1] if len(parts) > 1 else "").partition('?')
+            params = dict(p.partition('=')[::2] for p in query.split('&') if p)
+            try:
+                quality = min(max(int(params.get('q', self.quality)), 1), 100)
+            except ValueError:
+                quality = None
+            if quality is None:
+                self._reply(writer, "400 Bad Request", "text/plain", b"q must be a number, 1..100\n")
+            elif path == "/stream":
+                await self._stream(writer, quality)
+            elif path == "/snapshot":
+                jpeg = await self._jpeg(quality)
+                if jpeg is None:
+                    self._reply(writer, "503 Service Unavailable", "text/plain", b"no frames yet\n")
+                else:
+                    self._reply(writer, "200 OK", "image/jpeg", jpeg)
+            elif path == "/":
+                page = b'<html><body style="margin:0;background:#000"><img src="/stream" style="max-width:100%"></body></html>'
+                self._reply(writer, "200 OK", "text/html", page)
+            else:
+                self._reply(writer, "404 Not Found", "text/plain", b"use /stream or /snapshot\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError, ValueError):
+            pass  # client left or sent garbage
+        except asyncio.CancelledError:
+            pass  # server is stopping
+        finally:
+            self.tasks.discard(asyncio.current_task())
+            writer.close()
+
+    def _reply(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nCache-Control: no-cache\r\n\r\n".encode() + body)
+
+    async def _stream(self, writer, quality):
+        writer.write(b"HTTP/1.0 200 OK\r\nCache-Control: no-cache\r\n"
+                     b"Content-Type: multipart/x-mixed-replace; boundary=" + self.boundary + b"\r\n\r\n")
+        # drain() waits until about one frame is left in the buffer, not many of them
+        writer.transport.set_write_buffer_limits(high=64 * 1024)
+        self.clients += 1
+        try:
+            seq = 0
+            while True:
+                if self.latest[0] == seq:
+                    await asyncio.shield(self.tick)
+                    continue
+                seq = self.latest[0]
+                jpeg = await self._jpeg(quality)
+                if jpeg is None:
+                    continue
+                writer.write(b"--" + self.boundary + b"\r\nContent-Type: image/jpeg\r\n"
+                             + f"Content-Length: {len(jpeg)}\r\n\r\n".encode() + jpeg + b"\r\n")
+                await writer.drain()  # frames published meanwhile are skipped
+                self.sent += 1
+        finally:
+            self.clients -= 1
+
+# wakes Tk only when there is a new frame, nothing is polled: grabber thread
+# calls Notify(), pacer thread turns it into a <<NewFrame>> event (Tk calls from
+# other threads wait for the main loop, so the grabber doesn't do it itself).
+# at most one render is pending, frames arriving meanwhile are coalesced, and
+# renders are at least 1/max_fps apart
+class FramePacer:
+    def __init__(self, widget, render, max_fps=None):
+        self.widget = widget
+        self.render = render      # called on Tk thread
+        self.interval = 1.0 / max_fps if max_fps else 0
+        self.next_time = 0        # earliest time of the next render
+        self.pending = False
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        widget.bind("<<NewFrame>>", self._on_event)
+
+    def Start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="camplay-pacer", daemon=True)
+        self.thread.start()
+
+    def Stop(self):
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout=0.5)  # may hang in event_generate when Tk is gone
+            self.thread = None
+
+    # grabber sink, see FrameGrabber.AddSink
+    def Notify(self, seq=None, frame=None, stamp=None):
+        if not self.pending:
+            self.pending = True
+            self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if not self.running:
+                break
+            try:
+                self.widget.event_generate("<<NewFrame>>", when='tail')
+            except (tk.TclError, RuntimeError):
+                break  # window is gone
+
+    def _on_event(self, event=None):
+        delay = self.next_time - time.perf_counter()
+        if delay > 0:
+            self.widget.after(int(delay * 1000) + 1, self._render)
+        else:
+            self._render()
+
+    def _render(self):
+        self.pending = False  # newer frames wake us again from now on
+        self.next_time = time.perf_counter() + self.interval
+        self.render()
+
+# presenters put display-ready BGR frames on screen, common interface:
+#   Show(frame), Close()
+# tk one paints into the label and reuses a single PhotoImage while frame size
+# stays the same, no new Tk image object per frame
+class PresenterTk:
+    def __init__(self, label):
+        self.label = label
+        self.photo = None
+        self.size = None
+
+    def Show(self, frame):
+        height, width = frame.shape[:2]
+        if not frame.flags['C_CONTIGUOUS']:
+            frame = frame.copy()
+        # PIL swaps BGR->RGB while unpacking, no separate cvtColor buffer
+        im = Image.frombuffer("RGB", (width, height), frame, "raw", "BGR", 0, 1)
+        if self.photo is None or self.size != (width, height):
+            self.photo = ImageTk.PhotoImage(image=im)
+            self.size = (width, height)
+            self.label.imgtk = self.photo  # keep reference, tk doesn't
+            self.label.config(image=self.photo)
+        else:
+            self.photo.paste(im)
+
+    def Close(self):
+        self.photo = None
+
+# separate highgui window, no PIL/Tk image work at all. for throughput-critical
+# use, mouse zoom and scroll don't work there
+class PresenterCV2:
+    def __init__(self, label=None, name="camplay"):
+        self.name = name
+        cv2.namedWindow(self.name, cv2.WINDOW_AUTOSIZE)
+
+    def Show(self, frame):
+        cv2.imshow(self.name, frame)
+        cv2.waitKey(1)  # lets highgui paint
+
+    def Close(self):
+        cv2.destroyWindow(self.name)
+
+presenters = {'tk': PresenterTk, 'cv2': PresenterCV2}
+
+# where a frame pixel lands in the shown image. view is what CamPlay.view_frame
+# describes: {'size', 'scale', 'origin', 'frame_size', 'me_pos'}
+def view_point(view, x, y):
+    return  (int((x - view['origin'][0]) * view['scale'][0]), int((y - view['origin'][1]) * view['scale'][1]))
+
+# the same for drawing right on the frame, see OverlayCompositor.Burn
+def frame_view(frame, me_pos=None):
+    height, width = frame.shape[:2]
+    return  {'size': (width, height), 'scale': (1.0, 1.0), 'origin': (0, 0), 'frame_size': (width, height), 'me_pos': me_pos}
+
+# annotation drawn by draw(canvas, view) into a transparent BGRA canvas of the
+# shown image size, with colors as (b, g, r, 255). show() says if it's on,
+# key() changes when its content does (None - only the view matters).
+# burn: drawn on the frame itself instead, so it's in recordings and snapshots
+class OverlayLayer:
+    def __init__(self, name, draw, show=None, key=None, burn=False):
+        self.name = name
+        self.draw = draw
+        self.show = show or (lambda: True)
+        self.key = key or (lambda: None)
+        self.burn = burn
+        self.cache = None     # (key, x0, y0, bgr, mask or alpha), see OverlayCompositor
+
+# layers are rendered once into display-sized images and cached, then only
+# pasted onto every shown frame, after the downscale. a layer is rendered again
+# when view (size, zoom, offsets, me_pos) or its own key changes
+class OverlayCompositor:
+    def __init__(self):
+        self.layers = []
+
+    def Add(self, layer):
+        self.layers.append(layer)
+        return  layer
+
+    def Get(self, name):
+        return  next((layer for layer in self.layers if layer.name == name), None)
+
+    # burned layers go on a copy of the frame, the shared one stays clean
+    def Burn(self, frame, me_pos=None):
+        layers = [layer for layer in self.layers if layer.burn and layer.show()]
+        if not layers:
+            return  frame
+        frame = frame.copy()
+        view = frame_view(frame, me_pos)
+        for layer in layers:
+            layer.draw(frame, view)
+        return  frame
+
+    # pastes the rest onto display-ready image, in place
+    def Compose(self, image, view):
+        view_key = (view['size'], view['scale'], view['origin'], view['frame_size'], view['me_pos'])
+        for layer in self.layers:
+            if layer.burn or not layer.show():
+                continue
+            key = (view_key, layer.key())
+            if not layer.cache or layer.cache[0] != key:
+                layer.cache = self._render(layer, image.shape, view, key)
+            _, x0, y0, bgr, blend = layer.cache
+            if bgr is None:
+                continue  # nothing visible
+            region = image[y0:y0 + bgr.shape[0], x0:x0 + bgr.shape[1]]
+            if blend.dtype == bool:
+                np.copyto(region, bgr, where=blend)
+            else:
+                # anti-aliased edges, blended only inside the layer's bounding box
+                np.copyto(region, (region * (1 - blend) + bgr * blend).astype(np.uint8))
+        return  image
+
+    # keeps only the bounding box of what was drawn, opaque layers as a mask
+    def _render(self, layer, shape, view, key):
+        canvas = np.zeros(shape[:2] + (4,), np.uint8)
+        layer.draw(canvas, view)
+        alpha = canvas[:, :, 3]
+        points = cv2.findNonZero(alpha)
+        if points is None:
+            return  (key, 0, 0, None, None)
+        x0, y0, width, height = cv2.boundingRect(points)
+        bgr = canvas[y0:y0 + height, x0:x0 + width, :3].copy()
+        alpha = alpha[y0:y0 + height, x0:x0 + width, None]
+        if np.isin(alpha, (0, 255)).all():
+            blend = alpha == 255
+        else:
+            blend = alpha.astype(np.float32) / 255
+        return  (key, x0, y0, bgr, blend)
+
+# times every pipeline stage of every shown frame. cheap enough to stay on:
+# a perf_counter() call and a deque append per stage, percentiles are only
+# computed when somebody asks. usage per frame:
+#   Begin(seq, stamp), Mark('stage') after each stage, End()
+# capture side reports through Capture() from the grabber thread
+class FrameProfiler:
+    csv_columns = ('seq', 'time', 'read', 'motion', 'proc', 'burn', 'snapshot', 'view', 'overlay', 'present', 'latency')
+
+    def __init__(self, window=300, csv_path=None):
+        self.window = window   # rolling window, frames
+        self.stages = {}       # stage -> deque of ms
+        self.read_ms = {}      # seq -> camera read ms, for the csv
+        self.capture_stamps = deque(maxlen=window)
+        self.display_stamps = deque(maxlen=window)
+        self.current = None    # stage timings of the frame in progress
+        self.mark = None
+        self.start_stamp = None
+        self.summary = []      # overlay lines, refreshed a few times per second
+        self.first_frame = None  # ms from the start of the program to the first shown frame
+        self.summary_stamp = 0
+        self.csv_file = None
+        self.csv_writer = None
+        self.csv_rows = []
+        if csv_path:
+            self.csv_file = open(csv_path, 'w', newline='')
+            self.csv_writer = csv.DictWriter(self.csv_file, self.csv_columns, extrasaction='ignore')
+            self.csv_writer.writeheader()
+
+    def _add(self, stage, ms):
+        values = self.stages.get(stage)
+        if values is None:
+            values = self.stages[stage] = deque(maxlen=self.window)
+        values.append(ms)
+
+    # grabber thread, stamp is when frame arrived, read is seconds in Read()
+    def Capture(self, seq, stamp, read):
+        self.capture_stamps.append(stamp)
+        self._add('read', read * 1000)
+        if self.csv_writer:
+            self.read_ms[seq] = read * 1000
+
+    def Begin(self, seq, stamp):
+        self.mark = time.perf_counter()
+        self.start_stamp = stamp
+        self.current = {'seq': seq}
+
+    # the frame in progress was swapped for another one, i.e. from ProcPool
+    def Restamp(self, seq, stamp):
+        self.start_stamp = stamp
+        self.current['seq'] = seq
+
+    def Mark(self, stage):
+        now = time.perf_counter()
+        ms = (now - self.mark) * 1000
+        self.mark = now
+        self.current[stage] = ms
+        self._add(stage, ms)
+
+    def End(self):
+        now = time.perf_counter()
+        self.display_stamps.append(now)
+        latency = (now - self.start_stamp) * 1000
+        self._add('latency', latency)
+        if self.csv_writer:
+            row = self.current
+            row['read'] = self.read_ms.pop(row['seq'], None)
+            row['latency'] = latency
+            row['time'] = now
+            self.csv_rows.append(row)
+            if len(self.csv_rows) >= 100:
+                self.Flush()
+            if len(self.read_ms) > self.window:
+                self.read_ms.clear()  # frames that were never shown
+
+    # frames per second over the rolling window, kind is 'capture' or 'display'
+    def GetFPS(self, kind='display'):
+        stamps = list(self.capture_stamps if kind == 'capture' else self.display_stamps)
+        if len(stamps) < 2 or stamps[-1] == stamps[0]:
+            return  None
+        return  (len(stamps) - 1) / (stamps[-1] - stamps[0])
+
+    # returns {stage: (p50, p95, p99)} in ms
+    def GetPercentiles(self, percents=(50, 95, 99)):
+        result = {}
+        for stage, values in list(self.stages.items()):
+            if values:
+                result[stage] = tuple(np.percentile(np.fromiter(list(values), float), percents))
+        return  result
+
+    def GetSummary(self):
+        capture_fps, display_fps = self.GetFPS('capture'), self.GetFPS('display')
+        lines = [f"capture {capture_fps or 0:.1f} fps, display {display_fps or 0:.1f} fps"]
+        if self.first_frame is not None:
+            lines.append(f"first frame {self.first_frame:.0f} ms after start")
+        for stage, (p50, p95, p99) in self.GetPercentiles().items():
+            lines.append(f"{stage:<9}{p50:7.2f}{p95:7.2f}{p99:7.2f} ms")
+        return  lines
+
+    # draws summary on display-sized frame, in place
+    def DrawOverlay(self, frame):
+        now = time.perf_counter()
+        if now - self.summary_stamp > 0.5:
+            self.summary = self.GetSummary()
+            self.summary_stamp = now
+        for i, line in enumerate(self.summary):
+            cv2.putText(frame, line, (8, 18 + 16 * i), cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 255, 255, 255), 1, cv2.LINE_AA)
+        return  frame
+
+    def Flush(self):
+        if not self.csv_writer or not self.csv_rows:
+            return
+        self.csv_writer.writerows(self.csv_rows)
+        self.csv_rows = []
+        self.csv_file.flush()
+
+    def Close(self):
+        self.Flush()
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file, self.csv_writer = None, None
 
 # visualizer with some callback hooks, all features
 # as UI it has it's own events loop. keep this in mind
 class CamPlay:
-    def __init__(self, cam_id=0, cam=None, resolutions=None, initial_res=None):
+    # gui=False skips all tkinter, the frame pipeline works the same
+    def __init__(self, cam_id=0, cam=None, resolutions=None, initial_res=None, gui=True, folder=None, http=None):
         global  draw_green_cross, draw_red_cross, record_folder
         # basic init
         self.cam = cam
         self.camera_index = cam_id
+        self.grabber = None
+        self.window = None
+        self.commands = queue.Queue()  # headless control: from signals and stdin
+        self.presenter = None
+        self.pacer = None     # wakes the window for new frames, see FramePacer
+        self.on_processed = None  # (seq, frame, stamp) after every processed frame, i.e. CamMosaic's pacer
         self.frame_proc = draw_green_cross
         self.draw_red_cross = draw_red_cross
 
         # init in this order:
-        self.init_params(resolutions=resolutions, initial_res=initial_res)
+        self.init_params(resolutions=resolutions, initial_res=initial_res, folder=folder)
         self.init_camera()
-        self.init_window()
-        self.init_buttons()
-
-    def init_params(self, resolutions=None, initial_res=None):
+        self.stream = None
+        if http:
+            self.start_stream(*http)
+        if gui:
+            self.init_window()
+            self.init_buttons()
+
+    def init_params(self, resolutions=None, initial_res=None, folder=None):
         # more or less static constants and varibles
-        self.record_folder = record_folder  # Predefined folder for recording
-        self.initial_fps = None  # recording fps, if None then as is from the camera
-        self.codec_str = 'mp4v' # H264 mp4v
-        self.video_fourcc = cv2.VideoWriter_fourcc(*codec_str)  # Use 'mp4v' for MP4 format
-        self.video_ext = "mp4"   # video recording extensions, defines file format
-        self.image_ext = "jpg"   # snapshots' extensions, defines encoding format, can be png, tiff..
-        self.verbose = False     # add some info output to stdout
+        self.record_folder = folder or record_folder  # Predefined folder for recording
+        self.initial_fps = initial_fps  # recording fps, if None then as is from the camera
+        self.codec_str = codec_str # H264 mp4v
+        self.video_fourcc = cv2.VideoWriter_fourcc(*self.codec_str)  # Use 'mp4v' for MP4 format
+        self.video_ext = video_ext   # video recording extensions, defines file format
+        self.image_ext = image_ext   # snapshots' extensions, defines encoding format, can be png, tiff..
+        self.verbose = verbose     # add some info output to stdout
 
         global default_resolutions 
         self.common_resolutions = resolutions if resolutions else default_resolutions
@@ -180,9 +2302,23 @@ class CamPlay:
         self.red_cross = False  # Variable to toggle red cross drawing
         self.my_proc = False  # toggle frame_proc call
         self.recording = False
-        self.video_writer = None
+        self.video_writer = RecorderCV2(queue_size=record_queue, policy=record_policy)
         self.fps = None  # current fps
+        self.profiler = FrameProfiler(csv_path=profile_csv)  # always on, it's cheap
+        # crosses, stats and other annotations, drawn at window size, see OverlayCompositor
+        self.overlays = OverlayCompositor()
+        self.overlays.Add(OverlayLayer('red cross', self.overlay_red_cross, show=lambda: self.red_cross, burn=burn_red_cross))
+        self.overlays.Add(OverlayLayer('stats', lambda canvas, view: self.profiler.DrawOverlay(canvas),
+                                       show=lambda: self.show_stats, key=lambda: int(time.perf_counter() * 2)))
+        self.view_info = None  # how the last frame was shown, see view_frame
+        # capture and view buffers, enough for a full recorder queue too
+        self.frame_pool = FramePool(max_buffers=record_queue + 8) if frame_pool else None
+        self.show_stats = False  # profiler overlay
         self.snap_next = False  # save next frame
+        self.burst = None       # BurstCapture in progress
+        self.best = None        # BestSnapshot in progress
+        self.frame_seq = 0      # sequence number of the last shown frame, see FrameGrabber
+        self.processed = (0, None)  # (seq, frame) of the last processed frame
         # Variables for zoom and scroll
         self.zoom_factor = 1.0
         self.offset_x, self.offset_y = 0, 0
@@ -191,6 +2327,7 @@ class CamPlay:
         self.scroll_path = None
         self.frame_shape = None
         self.image_zoom = 1.0  # how much frame is stratched, depends on windw size
+        self.view_size = (640, 480)  # space for video in the window, updated by on_configure
         
         self.resolution_buttons = {}  # Dictionary to store resolution buttons
         self.current_resolution = None  # Variable to store the current resolution
@@ -201,24 +2338,52 @@ class CamPlay:
                 os.makedirs(self.record_folder)
         except Exception as e:
             print("creating folder exception: ", str(e))
-        
+        self.snapshots = SnapshotWriter(self.record_folder, self.image_ext, workers=snapshot_workers, verbose=self.verbose)
+        self.preroll = PreRollBuffer(preroll_seconds, preroll_mb * 2**20) if preroll_seconds else None
+        self.motion = MotionDetector(motion_level, post_roll=motion_post_roll) if motion_level else None
+        self.proc_pool = None  # created on first use, see get_proc_pool
+        self.passthrough = False  # recording camera's MJPG packets as they are
+        self.rec_full = False     # recording whole frames from the grabber, ROI is only shown
+        self.raw_writer = None    # lossless recording into a ring file, see RawRingWriter
         
     def init_camera(self):
         # Initialize the camera to default webcam
         if not self.cam:
             self.cam = CameraCV2(self.camera_index, start=True)
-        
+
+        # cached after the first run, so no renegotiating of the stream on later starts.
+        # noprobe still uses the cache, it only doesn't probe what is missing
+        if self.cam.IsOpen():
+            self.cam.GetCapabilities(self.common_resolutions, probe=probe_caps or reprobe_caps, reprobe=reprobe_caps)
+
         if self.initial_resolution:
             self.initial_width, self.initial_height = map(int, self.initial_resolution.split('x'))
             self.cam.SetResolution(self.initial_width, self.initial_height)
+        if initial_roi and self.cam.IsOpen():
+            self.cam.SetROI(*initial_roi)
         
         # Capture an initial frame to get the video size
         ret, self.frame = self.cam.Read()
+        if ret:
+            self.frame = self.cam.Crop(self.frame)
+        # from now on the camera is read on its own thread
+        self.grabber = FrameGrabber(self.cam, pool=self.frame_pool)
+        self.grabber.profiler = self.profiler
+        if self.preroll:
+            # at capture rate and unprocessed, as recordings get frames. camera's
+            # jpegs as they are, if recordings are going to be passthrough
+            if rec_passthrough and self.cam.IsCompressed():
+                self.grabber.AddPacketSink(self.preroll_frame)
+            else:
+                self.grabber.AddSink(self.preroll_frame)
+        self.grabber.Start()
         if not ret:
             print("Failed to grab frame")
-            self.cam.Close()
+            with self.grabber.Device():
+                self.cam.Close()
             return  False
         #self.height, self.width, _ = frame.shape
+        self.frame_shape = self.frame.shape
         return  True
         
     def init_window(self):
@@ -234,10 +2399,12 @@ class CamPlay:
         if self.verbose: print(f"initial settings: {self.current_resolution}")
         buttons_reserve = 108  # how much buttons take off the frame
         self.window.geometry(f"{int(width+buttons_reserve)}x{int(height)}")
+        self.view_size = (int(width), int(height))  # until the first <Configure>
 
         # Create a frame for video feed and buttons
         self.video_frame = tk.Frame(self.window)
         self.video_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.video_frame.bind("<Configure>", self.on_configure)
 
         self.button_frame = tk.Frame(self.window)
         self.button_frame.pack(side=tk.RIGHT, fill=tk.Y)
@@ -245,6 +2412,8 @@ class CamPlay:
         # Label for displaying the camera feed
         self.label = tk.Label(self.video_frame)
         self.label.pack(expand=True, fill=tk.BOTH)
+        self.presenter = presenters[presenter_name](self.label)
+        self.pacer = FramePacer(self.label, self.update_frame, display_fps)
 
         # Bind mouse events to the label
         #label.bind("<Button-1>", lambda e: handle_click(e, "click"))
@@ -263,6 +2432,16 @@ class CamPlay:
         # Bind middle mouse button for reset zoom
         self.label.bind("<Button-2>", self.reset_zoom)
 
+        # recorded video: arrows step a frame, with shift a second, space pauses
+        if hasattr(self.cam, 'Seek'):
+            fps = lambda: int(self.cam.GetFPS() or 30)
+            self.window.bind("<Left>", lambda e: self.cam.Step(-1))
+            self.window.bind("<Right>", lambda e: self.cam.Step(1))
+            self.window.bind("<Shift-Left>", lambda e: self.cam.Step(-fps()))
+            self.window.bind("<Shift-Right>", lambda e: self.cam.Step(fps()))
+            self.window.bind("<Home>", lambda e: self.cam.Seek(0))
+            self.window.bind("<space>", lambda e: self.cam.Pause())
+
     def init_buttons(self):
         # Buttons
         self.btn_play_stop = tk.Button(self.button_frame, text="Play/Stop", command=self.toggle_play_stop)
@@ -280,6 +2459,14 @@ class CamPlay:
         self.btn_my_proc = tk.Button(self.button_frame, text="My proc", command=self.toggle_my_proc)
         self.btn_my_proc.pack(fill=tk.X)
 
+        self.btn_stats = tk.Button(self.button_frame, text="Stats", command=self.toggle_stats)
+        self.btn_stats.pack(fill=tk.X)
+
+        # crops the camera to the zoomed area, everything downstream works on less pixels
+        self.btn_roi = tk.Button(self.button_frame, text="ROI", command=self.toggle_roi)
+        self.btn_roi.pack(fill=tk.X)
+        self.btn_roi.config(relief='sunken' if self.cam.roi else 'raised')
+
         # Create a single button for zoom control
         self.btn_zoom = tk.Button(self.button_frame, text="-  1:1  +")
         self.btn_zoom.pack(fill=tk.X)
@@ -289,17 +2476,30 @@ class CamPlay:
         self.btn_snapshot = tk.Button(self.button_frame, text="Snapshot", command=self.take_snapshot)
         self.btn_snapshot.pack(fill=tk.X, pady=(20, 0))
 
+        self.btn_burst = tk.Button(self.button_frame, text="Burst", command=self.take_burst)
+        self.btn_burst.pack(fill=tk.X)
+
+        self.btn_best = tk.Button(self.button_frame, text="Best", command=self.take_best_snapshot)
+        self.btn_best.pack(fill=tk.X)
+
         # Add record button
         self.btn_record = tk.Button(self.button_frame, text="Start", command=self.toggle_recording)
-        self.btn_record.pack(fill=tk.X, pady=(0, 20))
+        self.btn_record.pack(fill=tk.X)
         self.btn_record.config(text="Start", fg="red")
-        self.btn_record.config(state='disabled')  # disabling for now, doesn't always work. :\
+
+        self.btn_motion = tk.Button(self.button_frame, text="Motion", command=self.toggle_motion)
+        self.btn_motion.pack(fill=tk.X, pady=(0, 20))
+        self.btn_motion.config(relief='sunken' if self.motion else 'raised')
 
         self.btn_quit = tk.Button(self.button_frame, text="Quit", command=self.quit_application)
         self.btn_quit.pack(side=tk.BOTTOM, fill=tk.X, pady=(15, 0))
 
-        # Create buttons for resolutions
+        # Create buttons for resolutions, only those camera supports if it's known
+        supported = self.cam.GetSupportedResolutions()
+        supported = [f"{w}x{h}" for w, h in supported] if supported else None
         for res in self.common_resolutions[::-1]:
+            if supported is not None and res not in supported:
+                continue
             btn = tk.Button(self.button_frame, text=res, command=lambda r=res: self.change_frame_size(r))
             btn.pack(side=tk.BOTTOM, fill=tk.X)
             self.resolution_buttons[res] = btn
@@ -310,96 +2510,295 @@ class CamPlay:
         return  self.window.winfo_exists()
     
     def quit_application(self):
-        if self.recording:
-            self.video_writer.release()
-        self.window.quit()
+        self.presenter.Close()
+        self.window.quit()  # run() releases the rest
 
-    # Function to update the label with the camera feed
+    # Function to update the label with the camera feed, called by FramePacer
+    # only when the grabber has a new frame and it's time to show one
     def update_frame(self):
-        if self.play and self.cam.IsOpen():
-            ret, self.frame = self.cam.Read()
-            #print(f"ret: {ret}, shape: {frame.shape if ret else None}")
-            if ret:
-                # Resize frame to fit the current window while maintaining aspect ratio
-                def resize_frame():
-                    #nonlocal  frame, snap_next, frame_shape, image_zoom 
-                    nonlocal self
-                    # all preprocess and recording after processing, but before scaling
-                    if self.my_proc: 
-                        self.frame = self.frame_proc(self.frame, self.me_pos)
-                    if self.red_cross:
-                        self.frame = self.draw_red_cross(self.frame)
-                    if self.recording and self.video_writer:
-                        self.video_writer.write(self.frame)  # cv2_frame is the raw frame from the camera
-                    if self.snap_next:
-                        self.snap_next = False
-                        #global  record_folder, image_ext, verbose
-                        now = datetime.now()
-                        filename = now.strftime("snapshot_%Y-%m-%d_%H%M%S."+self.image_ext)
-                        filepath = os.path.join(self.record_folder, filename)
-                        cv2.imwrite(filepath, self.frame)
-                        if self.verbose: print(f"Snapshot saved: {filename}")
-                    self.frame_shape = self.frame.shape
-                    
-                    # applying zoom, for that cropping out area of interest
-                    #nonlocal  offset_x, offset_y, zoom_factor
-                    if self.zoom_factor != 1.0:
-                        height, width, _ = self.frame.shape
-                        cropped_frame = self.frame[int(self.offset_y):int(self.offset_y + height/self.zoom_factor),
-                                            int(self.offset_x):int(self.offset_x + width/self.zoom_factor)]
-                        #print("cropped shape: ", cropped_frame.shape)
-                        try:
-                            self.frame = cv2.resize(cropped_frame, (int(width), int(height)))                    
-                        except Exception as e:
-                            print("resize exception: ", str(e), "shape:", cropped_frame.shape, " ", width, "x", height)
-                            #print(self.zoom_factor, "::", int(self.offset_y), int(self.offset_y + height/self.zoom_factor),
-                            #                int(self.offset_x), int(self.offset_x + width/self.zoom_factor))
-                    
-                    # Resize frame to fit the current window while maintaining aspect ratio
-                    self.window.update_idletasks()  # Update window to get current sizes
-                    window_width = self.window.winfo_width() - self.button_frame.winfo_width()
-                    window_height = self.window.winfo_height()
-                    scale_w = window_width / self.frame.shape[1]
-                    scale_h = window_height / self.frame.shape[0]
-                    scale = min(scale_w, scale_h)
-                    self.image_zoom = scale
-                    frame_resized = cv2.resize(self.frame, (int(self.frame.shape[1] * scale)-2, int(self.frame.shape[0] * scale)-2))
-                    frame_resized = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-                    im = Image.fromarray(frame_resized)
-                    img = ImageTk.PhotoImage(image=im)
-                    self.label.imgtk = img
-                    self.label.config(image=img)
-                self.window.after(1, resize_frame)
-        #nonlocal button_frame
-        #print("width: ", button_frame.winfo_width())
-        self.label.after(10, self.update_frame)
-
-    def run(self):
-        # Start the update loop
-        self.update_frame()
+        if self.play:
+            # newest frame from the grabber thread, never blocks on the camera
+            seq, frame, stamp = self.grabber.GetLatest()
+            if seq != self.frame_seq:
+                self.frame_seq = seq
+                self.frame = frame
+                self.process_frame(seq, stamp)
+
+    # the pacer gets frames only while playing, paused window sleeps
+    def update_pacing(self):
+        if not self.pacer:
+            return
+        if self.play:
+            self.grabber.AddSink(self.pacer.Notify)
+            self.pacer.Notify()  # there may be a frame already
+        else:
+            self.grabber.RemoveSink(self.pacer.Notify)
+
+    # the whole per-frame pipeline on self.frame: processing, recording,
+    # snapshots, then resize to the window and show (if there is a presenter)
+    def process_frame(self, seq, stamp):
+        prof = self.profiler
+        prof.Begin(seq, stamp)
+        if self.motion:
+            # motion owns the recorder: starts and stops it, on the raw frame
+            if self.motion.Update(self.frame, stamp) != self.recording:
+                self.toggle_recording()
+            prof.Mark('motion')
+        # all preprocess and recording after processing, but before scaling
+        if self.my_proc and proc_workers:
+            # frame goes to the workers, what we get back is an earlier one, processed
+            pool = self.get_proc_pool()
+            pool.Submit(self.frame, self.me_pos, seq, stamp)
+            result = pool.Get()
+            prof.Mark('proc')
+            if result is None:
+                return  # nothing ready yet
+            seq, stamp, self.frame = result
+            prof.Restamp(seq, stamp)
+        elif self.my_proc: 
+            self.frame = self.proc_frame(self.frame, 'proc')
+            prof.Mark('proc')
+        if self.overlays.layers:
+            self.frame = self.overlays.Burn(self.frame, self.me_pos)  # a copy if anything is burned
+            prof.Mark('burn')
+        # recorder and pre-roll have their own grabber sinks, see toggle_recording
+        if self.snap_next:
+            self.snap_next = False
+            self.snapshots.Save(self.frame)  # written by snapshot pool
+            prof.Mark('snapshot')
+        self.frame_shape = self.frame.shape
+        
+        if self.presenter:
+            # zoomed area goes straight to the window size, in one resize
+            try:
+                frame_resized = self.view_frame(self.frame)
+            except Exception as e:
+                print("resize exception: ", str(e), "shape:", self.frame.shape, " view:", self.view_size)
+                return
+            prof.Mark('view')
+            self.overlays.Compose(frame_resized, self.view_info)
+            prof.Mark('overlay')
+            self.presenter.Show(frame_resized)
+            prof.Mark('present')
+        prof.End()
+        if prof.first_frame is None:
+            prof.first_frame = (time.perf_counter() - start_stamp) * 1000
+            if self.verbose: print(f"time to first frame: {prof.first_frame:.0f} ms")
+        self.fps = prof.GetFPS('display')
+        self.processed = (seq, self.frame)  # for whoever shows it elsewhere, i.e. CamMosaic
+        if self.on_processed:
+            self.on_processed(seq, self.frame, stamp)
+
+    # worker processes for frame_proc, started again when frame_proc was replaced
+    # (play.frame_proc = my_analysis after construction)
+    def get_proc_pool(self):
+        if self.proc_pool and self.proc_pool.proc != self.frame_proc:
+            self.proc_pool.Close()
+            self.proc_pool = None
+        if not self.proc_pool:
+            self.proc_pool = ProcPool(self.frame_proc, workers=proc_workers, depth=proc_depth, mode=proc_order)
+        return  self.proc_pool
+
+    # frame_proc on a copy in a pooled buffer of the role: it draws in place, and
+    # the grabber's frame is shared with sinks (recorder, stream) and with ROI
+    # it's a view into the whole frame
+    def proc_frame(self, frame, role):
+        if self.frame_pool:
+            buf = self.frame_pool.Get(role, frame.shape, frame.dtype)
+            np.copyto(buf, frame)
+        else:
+            buf = frame.copy()
+        return  self.frame_proc(buf, self.me_pos)
+
+    # viewport transform: crops the zoomed area (numpy view, no copy) and scales
+    # it right to the output size in a single pass, keeping aspect ratio.
+    # view_size is (width, height), cached window size if not given
+    def view_frame(self, frame, view_size=None):
+        view_width, view_height = view_size or self.view_size
+        height, width = frame.shape[:2]
+        # how much the whole frame is stretched to fit, mouse handlers rely on it
+        scale = min(view_width / width, view_height / height)
+        self.image_zoom = scale
+        out_size = (max(int(width * scale) - 2, 1), max(int(height * scale) - 2, 1))
+
+        x0, y0 = int(self.offset_x), int(self.offset_y)
+        x1 = min(int(self.offset_x + width / self.zoom_factor), width)
+        y1 = min(int(self.offset_y + height / self.zoom_factor), height)
+        roi = frame[y0:y1, x0:x1]
+        if roi.size == 0:
+            roi = frame   # offsets are stale, i.e. resolution just changed
+        # strong shrinking looks best with INTER_AREA, otherwise INTER_LINEAR is
+        # as good and several times cheaper
+        interpolation = cv2.INTER_AREA if out_size[0] * 2 <= roi.shape[1] else cv2.INTER_LINEAR
+        # for overlays: frame pixel (x, y) is shown at ((x - x0) * sx, (y - y0) * sy)
+        origin = (0, 0) if roi is frame else (x0, y0)
+        self.view_info = {'size': out_size, 'scale': (out_size[0] / roi.shape[1], out_size[1] / roi.shape[0]),
+                          'origin': origin, 'frame_size': (width, height), 'me_pos': self.me_pos}
+        if not self.frame_pool:
+            return  cv2.resize(roi, out_size, interpolation=interpolation)
+        # the previous view buffer is free again once presenter is done with it
+        view = self.frame_pool.Get('view', (out_size[1], out_size[0]) + roi.shape[2:], roi.dtype)
+        return  cv2.resize(roi, out_size, dst=view, interpolation=interpolation)
+
+    # keeps window geometry cached, so rendering doesn't query Tk every frame
+    def on_configure(self, event):
+        self.view_size = (max(event.width, 1), max(event.height, 1))
+
+    def run(self, duration=None):
+        if not self.window:
+            return  self.run_headless(duration)
+        # frames wake the window from now on
+        self.pacer.Start()
+        self.update_pacing()
 
         # Start the tkinter mainloop
         self.window.mainloop()
 
         # Release the camera when the window is closed
-        self.cam.Close()
+        self.grabber.RemoveSink(self.pacer.Notify)
+        self.pacer.Stop()
+        self.window = None  # gone or going, no more widget updates
+        self.close()
         
+    # no window at all: capture -> frame_proc -> record/snapshot, nothing is
+    # resized or converted for display. controlled by
+    #   duration - seconds to run, None is until 'quit'
+    #   stdin and signals, see install_controls()
+    def run_headless(self, duration=None):
+        install_controls(self.commands.put)
+        self.pipeline_loop(duration)
+        self.close()
+
+    # processes new frames and commands until 'quit', duration is over or stop is set
+    def pipeline_loop(self, duration=None, stop=None):
+        end = time.perf_counter() + duration if duration else None
+        running = True
+        while running:
+            while not self.commands.empty():
+                running = self.run_command(self.commands.get())
+            if (end and time.perf_counter() >= end) or (stop and stop.is_set()):
+                break
+            if not self.play:
+                time.sleep(0.1)
+                continue
+            seq, frame, stamp = self.grabber.WaitNew(self.frame_seq, timeout=0.1)
+            if seq != self.frame_seq:
+                self.frame_seq = seq
+                self.frame = frame
+                self.process_frame(seq, stamp)
+
+    # pipeline_loop on its own thread, for several cameras at once
+    def start_pipeline(self):
+        self.pipeline_stop = threading.Event()
+        self.pipeline_thread = threading.Thread(target=self.pipeline_loop, kwargs={'stop': self.pipeline_stop},
+                                                name=f"camplay-pipeline-{self.cam.GetId()}", daemon=True)
+        self.pipeline_thread.start()
+
+    def stop_pipeline(self):
+        self.pipeline_stop.set()
+        self.pipeline_thread.join()
+
+    # camera's frames over http, as they come from the grabber: no processing
+    # or overlays, and it doesn't wait for the window or pipeline
+    def start_stream(self, host, port):
+        self.stream = StreamServer(host, port, quality=stream_quality)
+        try:
+            self.stream.Start()
+        except OSError as e:
+            print(f"can't stream on {host}:{port}: ", str(e))
+            self.stream = None
+            return
+        self.grabber.AddSink(self.stream.Publish)
+        print(f"streaming camera {self.cam.GetId()} on http://{host}:{self.stream.port}/stream")
+
+    # stops recording and releases everything
+    def close(self):
+        if self.recording:
+            self.toggle_recording()
+        if self.stream:
+            self.grabber.RemoveSink(self.stream.Publish)
+            self.stream.Stop()
+        self.grabber.Stop()
+        self.cam.Close()
+        self.snapshots.Close()  # let queued snapshots finish
+        self.profiler.Close()
+        if self.preroll:
+            self.preroll.Close()
+        if self.proc_pool:
+            self.proc_pool.Close()
+
+    # returns False on quit
+    def run_command(self, command):
+        if command == 'snap':
+            self.take_snapshot()
+        elif command == 'burst':
+            self.take_burst()
+        elif command == 'best':
+            self.take_best_snapshot()
+        elif command == 'rec':
+            self.toggle_recording()
+        elif command in ('rec start', 'rec stop'):
+            # explicit, for whoever doesn't know the state, i.e. CamMosaic
+            if self.recording != (command == 'rec start'):
+                self.toggle_recording()
+        elif command == 'play':
+            self.toggle_play_stop()
+        elif command == 'motion':
+            self.toggle_motion()
+        elif command == 'stats':
+            print("\n".join(self.profiler.GetSummary()))
+        elif command.startswith(('seek', 'step')) and hasattr(self.cam, 'Seek'):
+            # seek <seconds>, step [frames]
+            word, _, value = command.partition(' ')
+            try:
+                target = self.cam.SeekTime(float(value)) if word == 'seek' else self.cam.Step(int(value or 1))
+            except (ValueError, OverflowError):
+                print("usage: seek <seconds> or step [<frames>]")
+                return  True
+            print(f"at frame {target}, {self.cam.GetTime(target):.2f} s")
+        elif command == 'pause' and hasattr(self.cam, 'Pause'):
+            self.cam.Pause()
+        elif command.startswith('roi'):
+            # roi x0,y0,width,height, plain roi - back to full frame
+            args = command.split()[1:]
+            try:
+                roi = tuple(map(int, args[0].split(','))) if args else None
+            except ValueError:
+                roi = ()
+            if roi is not None and len(roi) != 4:
+                print("usage: roi x0,y0,width,height or just roi for the full frame")
+                return  True
+            with self.grabber.Device():
+                if not roi:
+                    self.cam.ResetROI()
+                elif not self.cam.SetROI(*roi):
+                    print("empty ROI: ", args[0])
+            print("ROI: ", self.cam.GetROI())
+        elif command == 'quit':
+            return  False
+        elif command:
+            print(f"unknown command: {command}, use snap, burst, best, rec, motion, play, stats, roi, seek, step, pause or quit")
+        return  True
+
     # Function to reconnect the camera
     def reconnect_camera(self):
-        self.cam.Close()
-        self.cam.Open()
+        with self.grabber.Device():
+            self.cam.Close()
+            self.cam.Open()
         for btn in self.resolution_buttons.values():
             btn.config(state='normal', relief='raised')  # Re-enable all resolution buttons
         self.update_window_title()
 
     # Function to disconnect the camera
     def disconnect_camera(self):
-        self.cam.Close()
+        with self.grabber.Device():
+            self.cam.Close()
         self.update_window_title()
 
     # Function to toggle play/stop
     def toggle_play_stop(self):
         self.play = not self.play
+        self.update_pacing()
 
     # Function to toggle red cross
     def toggle_red_cross(self):
@@ -408,18 +2807,58 @@ class CamPlay:
     def toggle_my_proc(self):
         self.my_proc = not self.my_proc
 
+    # red cross layer through the draw_red_cross hook: it gets the shown image
+    # (or the frame itself when burned) and where the frame's center is in it
+    def overlay_red_cross(self, canvas, view):
+        width, height = view['frame_size']
+        self.draw_red_cross(canvas, view_point(view, width // 2, height // 2))
+
+    # fps, latency and per-stage timings over the video
+    def toggle_stats(self):
+        self.show_stats = not self.show_stats
+
+    # zoomed area becomes camera's ROI, or back to the full frame
+    def toggle_roi(self):
+        with self.grabber.Device():
+            if self.cam.roi:
+                x0, y0, roi_width, roi_height = self.cam.roi
+                self.cam.ResetROI()
+                # keep looking at the same area, now zoomed in the full frame
+                width, height = self.cam.GetResolution()
+                self.zoom_factor *= min(width / roi_width, height / roi_height)
+                self.offset_x += x0
+                self.offset_y += y0
+            else:
+                height, width = self.frame_shape[:2]
+                self.cam.SetROI(self.offset_x, self.offset_y, width / self.zoom_factor, height / self.zoom_factor)
+                self.zoom_factor, self.offset_x, self.offset_y = 1.0, 0, 0
+        if self.verbose: print("ROI: ", self.cam.GetROI())
+        if self.window:
+            self.btn_roi.config(relief='sunken' if self.cam.roi else 'raised')
+            self.update_window_title()
+
     # Function to change frame size
     def change_frame_size(self, size):
         width, height = map(int, size.split('x'))
-        ret = self.cam.SetResolution(width, height)
+        with self.grabber.Device():
+            old_width, old_height = self.cam.GetResolution()
+            roi = self.cam.roi
+            self.cam.ResetROI()
+            ret = self.cam.SetResolution(width, height)
+            if roi:
+                # ROI is in pixels of the old resolution, the same area in the new one
+                width, height = self.cam.GetResolution()
+                scale_x, scale_y = width / old_width, height / old_height
+                x0, y0, roi_width, roi_height = roi
+                self.cam.SetROI(round(x0 * scale_x), round(y0 * scale_y),
+                                round(roi_width * scale_x), round(roi_height * scale_y))
         if ret:
             #print(f"Resolution changed to {size}.")
             self.current_resolution = size
             self.update_button_styles()
-            # TODO: update offsets and zooms 
-            # height, width, _ = self.frame_shape
-            scale_x = width / self.frame_shape[1]
-            scale_y = height / self.frame_shape[0]
+            # offsets are in shown frame pixels, it scales as the resolution
+            scale_x = width / old_width
+            scale_y = height / old_height
             #print("scaling: ", scale_x, scale_y)
             self.offset_x *= scale_x
             self.offset_y *= scale_y
@@ -445,25 +2884,122 @@ class CamPlay:
                 filename = now.strftime("video_%Y-%m-%d_%H%M%S") + f".{self.video_ext}"
                 filepath = os.path.join(self.record_folder, filename)
                 fps = self.cam.GetFPS() if not self.initial_fps else self.initial_fps
+                if not fps:
+                    fps = 30  # some cameras don't report it
                 
                 height, width, _ = self.frame_shape
-                self.video_writer = cv2.VideoWriter(filepath, self.video_fourcc, fps, (width, height))
-                self.btn_record.config(text="Stop", fg="red")
-                print("recording into file: ", filepath)
+                preroll = self.preroll.Take() if self.preroll else None
+                self.passthrough = rec_passthrough and self.cam.IsCompressed()
+                segments = dict(segment_seconds=segment_minutes * 60 if segment_minutes else None,
+                                segment_mb=segment_mb, budget_mb=record_budget_mb)
+                self.rec_full = record_full and self.cam.roi is not None and not self.cam.hw_roi
+                if raw_ring_frames:
+                    # lossless, right from the grabber into a memory-mapped file, no encoding
+                    filepath = os.path.splitext(filepath)[0] + ".raw"
+                    if self.rec_full:
+                        width, height = map(int, self.cam.GetResolution())
+                    self.raw_writer = RawRingWriter()
+                    self.raw_writer.Open(filepath, fps, (width, height), raw_ring_frames)
+                    self.grabber.AddSink(self.record_raw, full=self.rec_full)
+                    self.rec_full = False
+                elif self.rec_full and not self.passthrough:
+                    # whole frames right from the grabber, ROI and processing are only shown
+                    width, height = map(int, self.cam.GetResolution())
+                    self.video_writer.Open(filepath, self.video_fourcc, fps, (width, height), **segments)
+                    self.grabber.AddSink(self.record_frame, full=True)
+                elif self.passthrough:
+                    # camera's jpegs straight into avi, right from the grabber, unprocessed
+                    filepath = os.path.splitext(filepath)[0] + ".avi"
+                    width, height = map(int, self.cam.GetResolution())  # packets are whole frames, ROI or not
+                    self.video_writer.Open(filepath, None, fps, (width, height), preroll=preroll, passthrough=True, **segments)
+                    self.grabber.AddPacketSink(self.record_packet)
+                else:
+                    # every captured frame, not just the shown ones: a slow window
+                    # doesn't speed the video up. processed on recorder's thread
+                    self.video_writer.Open(filepath, self.video_fourcc, fps, (width, height), preroll=preroll,
+                                           process=self.process_recorded, **segments)
+                    self.grabber.AddSink(self.record_frame)
+                if self.window:
+                    self.btn_record.config(text="Stop", fg="red")
+                print("recording into file: ", (self.raw_writer or self.video_writer).filepath
+                      + (f", pre-roll: {len(preroll)} frames" if preroll and not self.raw_writer else ""))
             except Exception as e:
                 print("creating video file exception: ", str(e), ", file name: ", filepath)
-                self.btn_record.config(state='disabled') 
+                self.recording = False
         else:
             # Stop recording
-            self.video_writer.release()
-            self.video_writer = None
-            self.btn_record.config(text="Start", fg="red")
+            if self.passthrough:
+                self.grabber.RemovePacketSink(self.record_packet)
+                self.passthrough = False
+            self.grabber.RemoveSink(self.record_frame)
+            self.rec_full = False
+            recorder = self.video_writer
+            if self.raw_writer:
+                self.grabber.RemoveSink(self.record_raw)
+                recorder, self.raw_writer = self.raw_writer, None
+            recorder.Close()
+            encoded, dropped, _ = recorder.GetStats()
+            print(f"recording stopped: {encoded} frames written, {dropped} dropped"
+                  + (f", {recorder.segments} files" if recorder.segments > 1 else ""))
+            if self.window:
+                self.btn_record.config(text="Start", fg="red")
+
+    # grabber's packet sink for passthrough recording
+    def record_packet(self, seq, packet, stamp):
+        self.video_writer.Write(packet)
+
+    # grabber's sink (or packet sink) for pre-roll, it gets what isn't recorded
+    def preroll_frame(self, seq, frame, stamp):
+        if not self.recording:
+            self.preroll.Put(frame, stamp)
+
+    # grabber's sink for recording, ROI or whole frames
+    def record_frame(self, seq, frame, stamp):
+        self.video_writer.Write(frame)
+
+    # what the video gets, as the window does: frame_proc if it's on, burned overlays
+    def process_recorded(self, frame):
+        if self.my_proc:
+            frame = self.proc_frame(frame, 'record')
+        return  self.overlays.Burn(frame, self.me_pos)
+
+    # grabber's sink for lossless recording, just a copy into the mapped file
+    def record_raw(self, seq, frame, stamp):
+        writer = self.raw_writer
+        if writer:
+            writer.Write(frame, seq, stamp)
 
     def take_snapshot(self):
         self.snap_next = True  # just setting the flag
+
+    # motion-triggered recording on/off, recording state is left as it is
+    def toggle_motion(self):
+        if self.motion:
+            self.motion = None
+        else:
+            self.motion = MotionDetector(motion_level or 0.01, post_roll=motion_post_roll)
+        if self.window:
+            self.btn_motion.config(relief='sunken' if self.motion else 'raised')
+
+    # raw frames straight from the grabber, no processing or crosses
+    def take_burst(self):
+        if self.burst and not self.burst.IsDone():
+            return  # one at a time
+        self.burst = BurstCapture(self.snapshots, count=burst_count, duration=burst_time)
+        self.grabber.AddSink(self.burst)
+
+    # the sharpest raw frame of the next best_window seconds, focus around me_pos
+    def take_best_snapshot(self):
+        if self.best and not self.best.IsDone():
+            return  # one at a time
+        self.best = BestSnapshot(self.snapshots, duration=best_window, pos=self.me_pos)
+        self.grabber.AddSink(self.best)
   
     def update_window_title(self):
-        self.window.title(f"Camera({self.cam.GetId() if self.cam else '?'}) zoom: {self.zoom_factor:.2f}")
+        if not self.window:
+            return
+        roi = f" ROI: {self.cam.roi}" if self.cam and self.cam.roi else ""
+        self.window.title(f"Camera({self.cam.GetId() if self.cam else '?'}) zoom: {self.zoom_factor:.2f}{roi}")
 
     def zoom_in(self, event=None):
         #nonlocal offset_x, offset_y, zoom_factor, frame_shape
@@ -581,31 +3117,469 @@ class CamPlay:
         #global  me_pos
         # Calculate click position relative to the scaled, zoomed, shifted frame
         try:
-            # transformation is: shift, user-zoom, window-zoom
-            #    reverse is : unzoom, unzoom, shift-back
-            
-            # external params: zoom_factor, offset_x, offset_y
-            # window-zoom factors, should be the same actually
-            cam_width, cam_height = self.cam.GetResolution()
-            scale_w = self.label.winfo_width() / cam_width
-            scale_h = self.label.winfo_height() / cam_height
-            
-            x, y = event.x, event.y  # in window's coordinates
-            x, y = int(x / scale_w), int(y / scale_h)  # window unzoom
-            x, y = int(x / self.zoom_factor), int(y / self.zoom_factor)  # user unzoom
-            x, y = int(x + self.offset_x), int(y + self.offset_y)  # user shift-back
+            # back through the transform the shown frame went through, see view_frame:
+            # the image is centered in the label, scaled, and starts at origin.
+            # in pixels of the shown frame, ROI or not
+            view = self.view_info
+            if not view:
+                return
+            x = event.x - (self.view_size[0] - view['size'][0]) / 2
+            y = event.y - (self.view_size[1] - view['size'][1]) / 2
+            x = int(x / view['scale'][0] + view['origin'][0])
+            y = int(y / view['scale'][1] + view['origin'][1])
+            frame_width, frame_height = view['frame_size']
 
         except Exception as e:
             print("exception: ", str(e))
             return
-        if self.verbose: print(f"{self.click_type}: ({x}, {y})")
+        if self.verbose: print(f"{click_type}: ({x}, {y})")
         if click_type == "double":
             #nonlocal full_screen
             self.full_screen = not self.full_screen
             self.window.attributes("-fullscreen", self.full_screen)
         else:
-            self.me_pos = (x/self.frame_shape[1], y/self.frame_shape[0])  # making relative
+            self.me_pos = (x / frame_width, y / frame_height)  # making relative
     
+# headless control: stdin lines and signals become commands for put(command)
+#   stdin    - lines: snap, burst, best, rec [start|stop], motion, play, stats, quit
+#   signals  - SIGUSR1 snapshot, SIGUSR2 start/stop recording, SIGINT/SIGTERM quit
+def install_controls(put):
+    if hasattr(signal, 'SIGUSR1'):  # not on windows
+        signal.signal(signal.SIGUSR1, lambda *args: put('snap'))
+        signal.signal(signal.SIGUSR2, lambda *args: put('rec'))
+    signal.signal(signal.SIGINT, lambda *args: put('quit'))
+    signal.signal(signal.SIGTERM, lambda *args: put('quit'))
+
+    def read_commands():
+        for line in sys.stdin:
+            put(line.strip())
+        # stdin closed (i.e. </dev/null or nohup), then only signals and duration
+    threading.Thread(target=read_commands, name="camplay-stdin", daemon=True).start()
+
+# several cameras at once. every camera is a gui-less CamPlay with its own
+# capture and pipeline threads, processing, recorder and snapshot folder, so
+# a slow camera doesn't hold up the others (opencv releases the GIL).
+# the window tiles their latest processed frames into one preallocated canvas,
+# its cost depends on the window size only, not on the number of cameras
+class CamMosaic:
+    def __init__(self, plays, gui=True):
+        self.plays = plays
+        self.cols = math.ceil(math.sqrt(len(plays)))
+        self.rows = math.ceil(len(plays) / self.cols)
+        self.canvas = None
+        self.tiles = []        # views into the canvas, one per camera
+        self.fits = []         # (x, y, width, height) of the frame inside its tile
+        self.shown = [0] * len(plays)  # seq of the frame in each tile
+        self.view_size = (1280, 720)
+        self.recording = False
+        self.show_stats = False
+        self.window = None
+        self.presenter = None
+        self.pacer = None      # woken by cameras' processed frames, see FramePacer
+        if gui:
+            self.init_window()
+
+    def init_window(self):
+        self.window = tk.Tk()
+        self.window.title("Cameras(" + ", ".join(str(p.cam.GetId()) for p in self.plays) + ")")
+        buttons_reserve = 108
+        self.window.geometry(f"{self.view_size[0] + buttons_reserve}x{self.view_size[1]}")
+        self.video_frame = tk.Frame(self.window)
+        self.video_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.video_frame.bind("<Configure>", self.on_configure)
+        self.button_frame = tk.Frame(self.window)
+        self.button_frame.pack(side=tk.RIGHT, fill=tk.Y)
+        self.label = tk.Label(self.video_frame)
+        self.label.pack(expand=True, fill=tk.BOTH)
+        self.presenter = presenters[presenter_name](self.label)
+        self.pacer = FramePacer(self.label, self.refresh, display_fps)
+
+        tk.Button(self.button_frame, text="Play/Stop", command=lambda: self.broadcast('play')).pack(fill=tk.X)
+        tk.Button(self.button_frame, text="Stats", command=self.toggle_stats).pack(fill=tk.X, pady=(10, 0))
+        tk.Button(self.button_frame, text="Snapshot", command=lambda: self.broadcast('snap')).pack(fill=tk.X, pady=(20, 0))
+        tk.Button(self.button_frame, text="Burst", command=lambda: self.broadcast('burst')).pack(fill=tk.X)
+        self.btn_record = tk.Button(self.button_frame, text="Start", fg="red", command=self.toggle_recording)
+        self.btn_record.pack(fill=tk.X, pady=(0, 20))
+        tk.Button(self.button_frame, text="Quit", command=self.window.quit).pack(side=tk.BOTTOM, fill=tk.X, pady=(15, 0))
+
+    # every camera handles commands on its own pipeline thread
+    def broadcast(self, command):
+        for play in self.plays:
+            play.commands.put(command)
+
+    # every camera ends up in the button's state, whatever it was in before
+    def toggle_recording(self):
+        self.recording = not self.recording
+        self.broadcast('rec start' if self.recording else 'rec stop')
+        if self.window:
+            self.btn_record.config(text="Stop" if self.recording else "Start")
+
+    def toggle_stats(self):
+        self.show_stats = not self.show_stats
+
+    def on_configure(self, event):
+        self.view_size = (max(event.width, 1), max(event.height, 1))
+        if self.pacer:
+            self.pacer.Notify()  # laid out again with the frames there are
+
+    def layout(self):
+        width, height = self.view_size
+        width, height = max(width - 2, self.cols), max(height - 2, self.rows)
+        self.canvas = np.zeros((height, width, 3), np.uint8)
+        tile_w, tile_h = width // self.cols, height // self.rows
+        gap = 2
+        self.tiles = []
+        for i in range(len(self.plays)):
+            x, y = (i % self.cols) * tile_w, (i // self.cols) * tile_h
+            self.tiles.append(self.canvas[y:y + tile_h - gap, x:x + tile_w - gap])
+        self.fits = [None] * len(self.plays)
+        self.shown = [0] * len(self.plays)
+
+    # puts new processed frames into their tiles, shows canvas if anything changed.
+    # called by the pacer only when some camera processed a frame
+    def refresh(self):
+        if self.canvas is None or self.canvas.shape[:2] != (self.view_size[1] - 2, self.view_size[0] - 2):
+            self.layout()
+        changed = False
+        for i, play in enumerate(self.plays):
+            seq, frame = play.processed
+            if frame is None or seq == self.shown[i]:
+                continue
+            self.shown[i] = seq
+            changed = True
+            tile = self.tiles[i]
+            tile_h, tile_w = tile.shape[:2]
+            height, width = frame.shape[:2]
+            scale = min(tile_w / width, tile_h / height)
+            fit_w, fit_h = max(int(width * scale), 1), max(int(height * scale), 1)
+            fit = ((tile_w - fit_w) // 2, (tile_h - fit_h) // 2, fit_w, fit_h)
+            if fit != self.fits[i]:
+                tile[:] = 0  # frame size changed, clear the margins
+                self.fits[i] = fit
+            x, y = fit[:2]
+            target = tile[y:y + fit_h, x:x + fit_w]
+            # downscaled straight into the canvas, no temporary frame
+            cv2.resize(frame, (fit_w, fit_h), dst=target,
+                       interpolation=cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR)
+            text = f"cam {play.cam.GetId()}"
+            if self.show_stats:
+                text += f"  {play.profiler.GetFPS('capture') or 0:.1f}/{play.fps or 0:.1f} fps"
+            if play.recording:
+                text += "  REC"
+            cv2.putText(target, text, (6, 18), cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 255, 255), 1, cv2.LINE_AA)
+        if changed:
+            self.presenter.Show(self.canvas)
+
+    def run(self, duration=None):
+        for play in self.plays:
+            play.start_pipeline()
+        if self.window:
+            self.pacer.Start()
+            for play in self.plays:
+                play.on_processed = self.pacer.Notify
+            self.pacer.Notify()  # there may be frames already
+            if duration:
+                self.window.after(int(duration * 1000), self.window.quit)
+            self.window.mainloop()
+            for play in self.plays:
+                play.on_processed = None
+            self.pacer.Stop()
+            self.presenter.Close()
+        else:
+            commands = queue.Queue()
+            install_controls(commands.put)
+            end = time.perf_counter() + duration if duration else None
+            while not end or time.perf_counter() < end:
+                try:
+                    command = commands.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if command == 'quit':
+                    break
+                self.broadcast(command)
+        for play in self.plays:
+            play.stop_pipeline()
+            play.close()
+
+# one frame every interval seconds, for days: no grabber, no window, nothing
+# runs between shots, and with close=True even the camera is closed. shots go
+# into record_folder/timelapse_<date>/ as image_ext files, or into one
+# video_ext video, written by a background worker batch shots at a time
+class TimeLapse:
+    def __init__(self, cam, interval, close=False, video=False, batch=10, folder=None, resolution=None, warmup=5):
+        self.cam = cam
+        self.interval = interval
+        self.close = close
+        self.video = video
+        self.batch = max(batch, 1)
+        self.resolution = resolution  # "WxH" set after every opening
+        self.warmup = warmup          # frames skipped after opening, exposure settles
+        self.folder = os.path.join(folder or record_folder, datetime.now().strftime("timelapse_%Y-%m-%d_%H%M%S"))
+        self.shots = 0
+        self.queue = queue.Queue()    # (number, stamp, frame) for the worker, None - flush and stop
+        self.writer = None            # cv2.VideoWriter in video mode
+        self.thread = None
+        self.tuned = None             # capture which has its driver buffer set to one frame
+
+    # shoots until duration is over or 'quit' comes from commands (queue.Queue,
+    # see install_controls), 'snap' shoots right away, off schedule
+    def Run(self, duration=None, commands=None):
+        os.makedirs(self.folder, exist_ok=True)
+        print(f"time-lapse every {self.interval} s into {self.folder}")
+        commands = commands or queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="camplay-timelapse", daemon=True)
+        self.thread.start()
+        end = time.perf_counter() + duration if duration else None
+        next_time = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if end and now >= end:
+                break
+            delay = next_time - now
+            if delay > 0:
+                # sleeping on the command queue: no polling, and quit is instant
+                try:
+                    command = commands.get(timeout=min(delay, end - now) if end else delay)
+                except queue.Empty:
+                    continue
+                if command == 'quit':
+                    break
+                if command != 'snap':
+                    if command: print(f"time-lapse: {self.shots} shots, next in {delay:.0f} s")
+                    continue
+            else:
+                next_time = max(next_time + self.interval, now)  # missed ones are skipped
+            self.Shoot()
+        self.Close()
+
+    def Shoot(self):
+        opened = False
+        if not self.cam.IsOpen():
+            self.cam.Open()
+            if self.resolution:
+                self.cam.SetResolution(*map(int, self.resolution.split('x')))
+            opened = True
+        cap = getattr(self.cam, 'cap', None)
+        if cap is not None and cap is not self.tuned:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # once per opening, it may restart the stream
+            self.tuned = cap
+        ret, frame = self._fresh(self.warmup if opened else 0)
+        if self.close:
+            self.cam.Close()
+        if not ret:
+            print("time-lapse: can't read the camera")
+            return  False
+        self.shots += 1
+        self.queue.put((self.shots, datetime.now(), frame))
+        return  True
+
+    # drops skip frames (too dark right after opening), then the ones waiting in
+    # driver's buffers, taken before the shot: reads until a frame has to be
+    # waited for, that one is taken now
+    def _fresh(self, skip):
+        period = 1 / (self.cam.GetFPS() or 30)
+        ret, frame = False, None
+        for count in range(skip + 8):
+            started = time.perf_counter()
+            ret, frame = self.cam.Read()
+            if not ret or (count >= skip and time.perf_counter() - started > period / 2):
+                break
+        return  ret, frame
+
+    def Close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.cam.Close()
+        print(f"time-lapse stopped: {self.shots} shots")
+
+    # collects batch shots and writes them at once, disk is touched rarely
+    def _run(self):
+        pending = []
+        while True:
+            item = self.queue.get()
+            if item is not None:
+                number, stamp, frame = item
+                if not self.video:
+                    frame = cv2.imencode(f".{image_ext}", frame)[1]  # encoded now, not kept raw
+                pending.append((number, stamp, frame))
+            if pending and (item is None or len(pending) >= self.batch):
+                try:
+                    self._write(pending)
+                except Exception as e:
+                    print("time-lapse writing exception: ", str(e))
+                pending = []
+            if item is None:
+                break
+        if self.writer:
+            self.writer.release()
+
+    def _write(self, shots):
+        if not self.video:
+            for number, stamp, data in shots:
+                name = stamp.strftime(f"frame_{number:06d}_%Y-%m-%d_%H%M%S.{image_ext}")
+                with open(os.path.join(self.folder, name), 'wb') as f:
+                    f.write(data.tobytes())
+            return
+        if not self.writer:
+            height, width = shots[0][2].shape[:2]
+            self.size = (width, height)
+            self.writer = cv2.VideoWriter(os.path.join(self.folder, f"timelapse.{video_ext}"),
+                                          cv2.VideoWriter_fourcc(*codec_str), timelapse_fps, self.size)
+        for number, stamp, frame in shots:
+            if (frame.shape[1], frame.shape[0]) != self.size:
+                frame = cv2.resize(frame, self.size)
+            self.writer.write(frame)
+
+# measures frames per second of every presenter at every resolution,
+# frames are already display-ready, so only presentation is timed
+def bench_presenters(resolutions=None, frames=100):
+    resolutions = resolutions or default_resolutions
+    window = tk.Tk()
+    label = tk.Label(window)
+    label.pack(expand=True, fill=tk.BOTH)
+    print(f"{'presenter':<10}" + "".join(f"{res:>12}" for res in resolutions))
+    for name, presenter_class in presenters.items():
+        presenter = presenter_class(label)
+        line = f"{name:<10}"
+        for res in resolutions:
+            width, height = map(int, res.split('x'))
+            # a few different frames, so nothing can be cached along the way
+            samples = [cv2.randu(np.empty((height, width, 3), np.uint8), 0, 255) for i in range(4)]
+            presenter.Show(samples[0])
+            window.update()
+            start = time.perf_counter()
+            for i in range(frames):
+                presenter.Show(samples[i % len(samples)])
+                window.update()  # tk paints only when events are processed
+            line += f"{frames / (time.perf_counter() - start):>10.1f}/s"
+        presenter.Close()
+        print(line)
+    window.destroy()
+
+# drives CamPlay's frame pipeline (without tk) with the given source,
+# reports throughput, latency percentiles and memory for a few typical setups.
+# make_cam(resolution) returns a camera, numbers are comparable between runs
+# on the same box, so it works as a regression gate for optimisations
+def bench_pipeline(make_cam, resolutions=None, seconds=3.0, view_size=(800, 600)):
+    import tracemalloc
+    try:
+        import resource
+    except ImportError:
+        resource = None   # windows
+    resolutions = resolutions or default_resolutions
+    scenarios = [
+        ("plain", {}),
+        ("zoom x3", {'zoom_factor': 3.0}),
+        ("proc+cross", {'my_proc': True, 'red_cross': True}),
+        ("recording", {'recording': True}),
+    ]
+
+    # display path without tk, so it's measured up to the presentation
+    class NullPresenter:
+        def Show(self, frame):
+            pass
+        def Close(self):
+            pass
+
+    print(f"{'resolution':<11}{'setup':<12}{'capture':>9}{'pipeline':>10}"
+          f"{'lat p50':>9}{'p95':>7}{'p99':>7}{'dropped':>9}{'peak MB':>9}{'new bufs':>10}")
+    tracemalloc.start()
+    for res in resolutions:
+        width, height = map(int, res.split('x'))
+        for name, settings in scenarios:
+            play = CamPlay(cam=make_cam((width, height)), gui=False)
+            play.presenter = NullPresenter()
+            play.view_size = view_size
+            for key, value in settings.items():
+                if key != 'recording':
+                    setattr(play, key, value)
+            if settings.get('recording'):
+                play.toggle_recording()  # the way the button does it
+            tracemalloc.reset_peak()
+            # buffers the pool has to create after the start, 0 in steady state
+            allocated = play.frame_pool.GetStats()[0] if play.frame_pool else 0
+            end = time.perf_counter() + seconds
+            processed = 0
+            while time.perf_counter() < end:
+                seq, frame, stamp = play.grabber.GetLatest()
+                if seq == play.frame_seq:
+                    time.sleep(0.0005)
+                    continue
+                play.frame_seq = seq
+                play.frame = frame
+                play.process_frame(seq, stamp)
+                processed += 1
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            allocated = play.frame_pool.GetStats()[0] - allocated if play.frame_pool else '-'
+            play.grabber.Stop()
+            captured = play.grabber.seq - 1  # first was read by init_camera
+            capture_fps = play.profiler.GetFPS('capture') or 0
+            latency = play.profiler.GetPercentiles().get('latency', (0, 0, 0))
+            if play.recording:
+                play.toggle_recording()
+                os.remove(play.video_writer.filepath)
+            play.cam.Close()
+            play.snapshots.Close()
+            print(f"{res:<11}{name:<12}{capture_fps:>7.1f}/s{processed / seconds:>8.1f}/s"
+                  f"{latency[0]:>9.2f}{latency[1]:>7.2f}{latency[2]:>7.2f}"
+                  f"{max(captured - processed, 0):>9}{peak:>9.1f}{allocated:>10}")
+    tracemalloc.stop()
+    if resource:
+        print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+# regression gate for CameraPlayback: steps forward and back frame by frame while
+# paused, plays, seeks around at random, and compares every frame it shows with a
+# plain decode of the file's first frames. returns True if all of them matched
+def check_playback(filepath, frames=120, seeks=50):
+    reference = []
+    cap = cv2.VideoCapture(filepath)
+    while len(reference) < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        reference.append(frame)
+    cap.release()
+    if not reference:
+        print("can't read ", filepath)
+        return  False
+    cam = CameraPlayback(filepath, pace=False, start=True)
+    checked, mismatches = 0, []
+
+    def expect(what, n):
+        nonlocal checked
+        ret, frame = cam.Read()
+        shown = cam.GetPosition()[0]
+        checked += 1
+        if not ret or shown != n or not np.array_equal(frame, reference[n]):
+            mismatches.append(f"{what}: expected frame {n}, shown {shown}")
+
+    last = len(reference) - 1
+    cam.Pause(True)
+    cam.Seek(0)
+    expect("seek", 0)
+    for n in range(1, last + 1):
+        cam.Step(1)
+        expect("step forward", n)
+    for n in range(last - 1, -1, -1):
+        cam.Step(-1)
+        expect("step back", n)
+    expect("paused", 0)  # no seek, the same frame again
+    randoms = np.random.default_rng(1).integers(0, last + 1, seeks)
+    for n in randoms:
+        cam.Seek(n)
+        expect("seek", int(n))
+    cam.Pause(False)
+    cam.Seek(last // 2)
+    for n in range(last // 2, last + 1):
+        expect("play", n)
+    cam.Close()
+    print(f"playback check of {filepath}: {checked} frames, {len(mismatches)} mismatched")
+    for line in mismatches[:10]:
+        print("  ", line)
+    return  not mismatches
+
 def display_help():
     help_message = f"""
     Usage: python your_script.py [options] [resolutions...]
@@ -613,6 +3587,10 @@ def display_help():
     Options:
     --help, /?      Show this help message and exit
     cam=<index>     Specify the camera index (default is {default_camera_index})
+    cam=<i>,<j>..   Several indices, all are tried at once, the first which opens is used
+    find_timeout=<s>  How long to wait for any of them (default is {discovery_timeout})
+    multi           Open all cameras listed in cam= at once, shown as a mosaic,
+                        each records and snaps into its own <path>/cam<index> folder
     fps=<fps>       Recording's frames-per-second (default is same as cam's video)
     path=<folder>   Specify output path. folder will be created if needed
                         (default is {record_folder})
@@ -622,6 +3600,72 @@ def display_help():
                         (defaul is {video_ext})
     img=<ext>       Image snapshot's format, like jpg, png, tiff
                         (defailt is {image_ext})
+    rec_queue=<n>   How many frames may wait for the video encoder (default is {record_queue})
+    rec_policy=<p>  What to do when encoder falls behind: block, drop-oldest, drop-newest
+                        (default is {record_policy})
+    burst=<n>       Frames taken by Burst button (default is {burst_count}),
+    burst=<t>s          or all frames for t seconds, like burst=2.5s
+    best=<t>        Best button saves the sharpest frame of that many seconds (default is {best_window}),
+                        focus is measured around the last clicked point
+    view=<name>     How frames are shown: tk (in the window) or cv2 (separate
+                        highgui window, fastest, no mouse control) (default is {presenter_name})
+    http=[host:]<port>  Stream over http: /stream (mjpeg) and /snapshot, ?q=<1..100> for
+                        jpeg quality. with multi, next cameras get next ports
+    http_q=<n>      Default jpeg quality of the stream (default is {stream_quality})
+    nopool          Allocate new frame buffers for every frame, for comparison
+    burn_cross      Red cross goes into recordings and snapshots, not only on the screen
+    display_fps=<n> Max window refresh rate, capture and recording aren't limited by it
+                        (default is {display_fps})
+    profile=<file>  Save per-frame stage timings into csv file, for offline analysis
+    timelapse=<s>   Time-lapse: one frame every that many seconds into <path>/timelapse_<date>,
+                        until duration is over or quit (stdin or a signal), no window
+    tl_close        Close the camera between time-lapse shots
+    tl_video        Time-lapse into one video (at {timelapse_fps} fps) instead of {image_ext} files
+    tl_batch=<n>    Shots kept in memory before they are written (default is {timelapse_batch})
+    synth=<W>x<H>[@fps]  Use synthetic frames instead of a camera, like synth=1920x1080@30
+    file=<video>    Use video file (looped) instead of a camera
+    review=<video>  Play a recording: arrows step a frame, shift+arrows a second, space
+                        pauses, Home goes to the start (headless: seek <s>, step <n>, pause)
+    headless        No window: capture, process, record and snapshot only. control it
+                        with stdin lines (snap, burst, rec, motion, play, stats, quit)
+                        or signals (USR1 - snapshot, USR2 - start/stop recording)
+    record          Start recording right away
+    preroll=<sec>   Keep that many seconds in memory (JPEG) and put them in front
+                        of every recording (default is {preroll_seconds}, off)
+    workers=<n>     Run 'My proc' in n worker processes, frames are passed through
+                        shared memory (default is {proc_workers}, inline)
+    depth=<n>       Frames in flight for the workers (default is twice the workers)
+    order=<mode>    Workers' results: ordered (every frame) or latest (newest wins)
+                        (default is {proc_order})
+    motion=<level>  Record only while there is motion: level is the share of changed
+                        pixels that starts recording, like motion=0.01 (default is off)
+    post_roll=<sec> Seconds without motion before recording stops (default is {motion_post_roll})
+    preroll_mb=<mb> Memory budget for pre-roll, oldest frames go first (default is {preroll_mb})
+    mjpg            Ask the camera for MJPG, usually the only way to get 30 fps at full HD
+    mjpg_raw        MJPG and keep frames compressed, decode them on worker threads only
+                        when they are shown or processed
+    segment=<min>   Record into a new file every that many minutes (name_000, name_001, ...)
+    segment_mb=<n>  Record into a new file when it grows over that many megabytes
+    keep_mb=<n>     Delete the oldest recordings when the folder is bigger than that
+    roi=x,y,w,h     Crop the camera to this range of interest (in pixels of the resolution),
+                        the ROI button does it for the zoomed area
+    rec_full        With ROI record whole frames, ROI is only for showing and processing
+    passthrough     With mjpg_raw record camera's jpegs into avi as they are, no decode
+                        and re-encode (no processing or crosses in the video)
+    probe           Probe camera's resolutions and formats again, ignoring the cache
+    noprobe         Don't probe, use only what is cached in
+                        {caps_cache_path}
+    duration=<sec>  Quit after that many seconds, mostly for headless
+    --bench         Run the frame pipeline benchmark and exit, with synthetic frames
+                        at each resolution (at file's frames if file= is given)
+    --bench-view    Measure frames per second of every view at every resolution and exit
+    --check-review <video>  Check review= playback: stepping, seeking and playing must
+                        show the same frames as a plain decode, exit code 1 if not
+    --transcode <file.raw> [<first>:<last>]  Encode raw ring recording (or its frames
+                        first..last-1) into video files, one part per core, and exit.
+                        codec= and vid= apply, before or after the file
+    raw=<frames>    Record lossless raw frames, unprocessed, into a memory-mapped ring file
+                        of that many frames (the oldest get overwritten), see --transcode
     mouse can be used to zoom in/out and to scroll around
     
     Resolutions:
@@ -636,16 +3680,41 @@ def display_help():
 
 def main():
     global  default_camera_index, initial_fps, record_folder, video_fourcc
-    global  codec_str, video_ext, image_ext
+    global  codec_str, video_ext, image_ext, record_queue, record_policy
+    global  burst_count, burst_time, presenter_name, profile_csv, display_fps, best_window
+    global  preroll_seconds, preroll_mb, motion_level, motion_post_roll
+    global  probe_caps, reprobe_caps, proc_workers, proc_depth, proc_order
+    global  capture_format, capture_raw, rec_passthrough, initial_roi, record_full
+    global  segment_minutes, segment_mb, record_budget_mb, http_address, stream_quality, frame_pool
+    global  discovery_timeout, raw_ring_frames, burn_red_cross
+    global  timelapse_interval, timelapse_close, timelapse_video, timelapse_batch
     # if help requested just print and exit
     if '--help' in sys.argv or '/?' in sys.argv:
         display_help()
         sys.exit()
+    if '--bench-view' in sys.argv:
+        bench_presenters()
+        sys.exit()
+    if '--check-review' in sys.argv:
+        args = sys.argv[sys.argv.index('--check-review') + 1:]
+        if not args:
+            print("usage: camplay.py --check-review <video>")
+            sys.exit(1)
+        sys.exit(0 if check_playback(args[0]) else 1)
         
     # Default common resolutions and camera index
     initial_resolution = None
     custom_resolutions = []
     camera_index = default_camera_index  # Default camera index
+    synth = None      # (width, height, fps) of synthetic source
+    video_file = None
+    review = False    # video_file is played back for reviewing, see CameraPlayback
+    bench = False
+    headless = False
+    multi = False
+    record_now = False
+    duration = None
+    transcode = None  # [<file.raw>, <first>:<last>] after --transcode
 
     # Parse command line arguments
     for arg in sys.argv[1:]:
@@ -666,9 +3735,148 @@ def main():
             video_ext = arg.split('=')[1]            
         elif arg.startswith('img='):
             image_ext = arg.split('=')[1]            
+        elif arg.startswith('rec_queue='):
+            record_queue = int(arg.split('=')[1])
+        elif arg.startswith('rec_policy='):
+            record_policy = arg.split('=')[1]
+            if record_policy not in RecorderCV2.policies:
+                print(f"unknown rec_policy: {record_policy}, use one of {RecorderCV2.policies}")
+                sys.exit(1)
+        elif arg.startswith('display_fps='):
+            display_fps = float(arg.split('=')[1])
+        elif arg.startswith('view='):
+            presenter_name = arg.split('=')[1]
+            if presenter_name not in presenters:
+                print(f"unknown view: {presenter_name}, use one of {list(presenters)}")
+                sys.exit(1)
+        elif arg.startswith('profile='):
+            profile_csv = arg.split('=')[1]
+        elif arg.startswith('best='):
+            best_window = float(arg.split('=')[1])
+        elif arg.startswith('burst='):
+            value = arg.split('=')[1]
+            if value.endswith('s'):
+                burst_time = float(value[:-1])
+            else:
+                burst_count = int(value)
+        elif arg.startswith('synth='):
+            size, _, fps = arg.split('=')[1].partition('@')
+            width, height = map(int, size.split('x'))
+            synth = (width, height, float(fps) if fps else 30)
+        elif arg.startswith('file='):
+            video_file = arg.split('=', 1)[1]
+        elif arg.startswith('review='):
+            video_file, review = arg.split('=', 1)[1], True
+        elif arg == '--bench':
+            bench = True
+        elif arg == 'headless':
+            headless = True
+        elif arg == 'multi':
+            multi = True
+        elif arg == 'record':
+            record_now = True
+        elif arg.startswith('preroll='):
+            preroll_seconds = float(arg.split('=')[1])
+        elif arg.startswith('preroll_mb='):
+            preroll_mb = float(arg.split('=')[1])
+        elif arg.startswith('motion='):
+            motion_level = float(arg.split('=')[1])
+        elif arg.startswith('post_roll='):
+            motion_post_roll = float(arg.split('=')[1])
+        elif arg.startswith('workers='):
+            proc_workers = int(arg.split('=')[1])
+        elif arg.startswith('depth='):
+            proc_depth = int(arg.split('=')[1])
+        elif arg.startswith('order='):
+            proc_order = arg.split('=')[1]
+            if proc_order not in ProcPool.modes:
+                print(f"unknown order: {proc_order}, use one of {ProcPool.modes}")
+                sys.exit(1)
+        elif arg == 'mjpg':
+            capture_format = 'MJPG'
+        elif arg == 'mjpg_raw':
+            capture_format, capture_raw = 'MJPG', True
+        elif arg == 'passthrough':
+            rec_passthrough = True
+        elif arg.startswith('roi='):
+            initial_roi = tuple(map(int, arg.split('=')[1].split(',')))
+        elif arg == 'rec_full':
+            record_full = True
+        elif arg.startswith('segment='):
+            segment_minutes = float(arg.split('=')[1])
+        elif arg.startswith('segment_mb='):
+            segment_mb = float(arg.split('=')[1])
+        elif arg.startswith('keep_mb='):
+            record_budget_mb = float(arg.split('=')[1])
+        elif arg.startswith('http='):
+            host, _, port = arg.split('=')[1].rpartition(':')
+            http_address = (host or '0.0.0.0', int(port))
+        elif arg.startswith('timelapse='):
+            timelapse_interval = float(arg.split('=')[1])
+        elif arg == 'tl_close':
+            timelapse_close = True
+        elif arg == 'tl_video':
+            timelapse_video = True
+        elif arg.startswith('tl_batch='):
+            timelapse_batch = int(arg.split('=')[1])
+        elif arg == 'burn_cross':
+            burn_red_cross = True
+        elif arg.startswith('raw='):
+            raw_ring_frames = int(arg.split('=')[1])
+        elif arg.startswith('find_timeout='):
+            discovery_timeout = float(arg.split('=')[1])
+        elif arg == 'nopool':
+            frame_pool = False
+        elif arg.startswith('http_q='):
+            stream_quality = int(arg.split('=')[1])
+        elif arg == 'probe':
+            reprobe_caps = True
+        elif arg == 'noprobe':
+            probe_caps = False
+        elif arg.startswith('duration='):
+            duration = float(arg.split('=')[1])
+        elif arg == '--transcode':
+            transcode = []
+        elif transcode is not None and len(transcode) < 2 and '=' not in arg:
+            transcode.append(arg)
         else:
             custom_resolutions.append(arg)
 
+    if transcode is not None:
+        first, last = None, None
+        try:
+            if len(transcode) > 1:
+                first, last = (int(s) if s else None for s in transcode[1].split(':'))
+        except ValueError:
+            transcode = []
+        if not transcode:
+            print("usage: camplay.py --transcode <file.raw> [<first>:<last>] [codec=<fourcc>] [vid=<ext>]")
+            sys.exit(1)
+        started = time.perf_counter()
+        for path in transcode_raw(transcode[0], first, last):
+            print("transcoded into: ", path)
+        print(f"done in {time.perf_counter() - started:.1f} s")
+        sys.exit()
+
+    if bench:
+        if video_file:
+            def make_cam(size):
+                cam = CameraFile(video_file, pace=False, start=True)
+                cam.SetResolution(*size)
+                return  cam
+            if not custom_resolutions:
+                # file's own resolution
+                cam = CameraFile(video_file, start=True)
+                width, height = cam.GetResolution()
+                cam.Close()
+                custom_resolutions = [f"{int(width)}x{int(height)}"]
+            bench_pipeline(make_cam, resolutions=custom_resolutions)
+        else:
+            fps = synth[2] if synth else 0  # as fast as possible by default
+            bench_pipeline(lambda size: CameraSynthetic(size, fps=fps, start=True),
+                           resolutions=custom_resolutions or None)
+        sys.exit()
+
     # Check if the camera is available
     camera_found = None
     """
@@ -696,12 +3904,54 @@ def main():
     # Remove duplicates and sort the resolutions
     custom_resolutions = sorted(set(custom_resolutions), key=lambda x: (int(x.split('x')[0]), int(x.split('x')[1])))
 
-    cam = CameraCV2(camera_index, start=True)
+    if timelapse_interval:
+        if synth:
+            cam = CameraSynthetic(synth[:2], fps=synth[2])
+        elif video_file:
+            cam = CameraFile(video_file)
+        else:
+            cam = CameraCV2(camera_index, fourcc=capture_format)
+        lapse = TimeLapse(cam, timelapse_interval, close=timelapse_close, video=timelapse_video,
+                          batch=timelapse_batch, resolution=initial_resolution)
+        commands = queue.Queue()
+        install_controls(commands.put)
+        lapse.Run(duration, commands)
+        return
+
+    if multi:
+        plays = []
+        for index in (camera_index if isinstance(camera_index, list) else [camera_index]):
+            cam = CameraCV2(index, start=True, fourcc=capture_format, raw=capture_raw)
+            if not cam.IsOpen():
+                print(" camera not found, id: ", index)
+                continue
+            http = (http_address[0], http_address[1] + len(plays)) if http_address else None
+            plays.append(CamPlay(cam=cam, cam_id=index, resolutions=custom_resolutions, initial_res=initial_resolution,
+                                 gui=False, folder=os.path.join(record_folder, f"cam{index}"), http=http))
+        if not plays:
+            sys.exit(1)
+        mosaic = CamMosaic(plays, gui=not headless)
+        if record_now:
+            mosaic.toggle_recording()
+        mosaic.run(duration)
+        return
+
+    if synth:
+        cam = CameraSynthetic(synth[:2], fps=synth[2], start=True)
+    elif video_file and review:
+        cam = CameraPlayback(video_file, start=True)
+    elif video_file:
+        cam = CameraFile(video_file, start=True)
+    else:
+        cam = CameraCV2(camera_index, start=True, fourcc=capture_format, raw=capture_raw)
     if not cam.IsOpen():
         print(" camera not found, id(s) checked: ", camera_index)
     play = CamPlay(cam=cam, cam_id=camera_found, 
-                   resolutions=custom_resolutions, initial_res=initial_resolution)
-    play.run()
+                   resolutions=custom_resolutions, initial_res=initial_resolution, gui=not headless,
+                   http=http_address)
+    if record_now:
+        play.toggle_recording()
+    play.run(duration)
 
     #display_camera(camera_index, initial_resolution, custom_resolutions)
     